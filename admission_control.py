@@ -0,0 +1,199 @@
+import asyncio
+import json
+import math
+import time
+
+from fastapi.responses import JSONResponse
+
+from config_util import get_config_value
+from logger import logger
+from server_timing import span
+
+TEXT_LANE = "text"
+AUDIO_LANE = "audio"
+BATCH_LANE = "batch"
+
+admission_enabled = get_config_value('admission', 'admission_enabled', None).lower() == "true"
+max_queue_wait = float(get_config_value('admission', 'max_queue_wait_seconds', None))
+
+
+class AdmissionLane:
+    """
+    A bounded queue with its own concurrency limit for one class of requests.
+    Requests which would wait longer than the allowed queue time are shed.
+    """
+
+    def __init__(self, name, max_concurrency, max_queue, initial_service_time, max_wait=max_queue_wait):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.avg_service_time = initial_service_time
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.shed = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def estimated_wait(self):
+        """
+        Estimates the queue wait of a new request from the queue depth and the moving average service time.
+        """
+        if self.active < self.max_concurrency and self.queued == 0:
+            return 0.0
+        return (self.queued + 1) * self.avg_service_time / self.max_concurrency
+
+    def retry_after(self):
+        return max(1, math.ceil(self.estimated_wait()))
+
+    async def acquire(self):
+        """
+        Waits for a free slot in the lane.
+
+        Returns:
+            True if the request was admitted, False if it was shed.
+        """
+        if self.queued >= self.max_queue or self.estimated_wait() > self.max_wait:
+            self.shed += 1
+            return False
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            self.shed += 1
+            return False
+        finally:
+            self.queued -= 1
+        self.active += 1
+        self.admitted += 1
+        return True
+
+    def release(self, service_time):
+        self.active -= 1
+        # Exponentially weighted moving average of the time a request holds its slot
+        self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * service_time
+        self._semaphore.release()
+
+    def metrics(self):
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "avg_service_time": round(self.avg_service_time, 3),
+            "estimated_wait": round(self.estimated_wait(), 3)
+        }
+
+
+lanes = {
+    TEXT_LANE: AdmissionLane(
+        TEXT_LANE,
+        max_concurrency=int(get_config_value('admission', 'text_max_concurrency', None)),
+        max_queue=int(get_config_value('admission', 'text_max_queue', None)),
+        initial_service_time=float(get_config_value('admission', 'text_initial_service_time', None))
+    ),
+    AUDIO_LANE: AdmissionLane(
+        AUDIO_LANE,
+        max_concurrency=int(get_config_value('admission', 'audio_max_concurrency', None)),
+        max_queue=int(get_config_value('admission', 'audio_max_queue', None)),
+        initial_service_time=float(get_config_value('admission', 'audio_initial_service_time', None))
+    ),
+    BATCH_LANE: AdmissionLane(
+        BATCH_LANE,
+        max_concurrency=int(get_config_value('admission', 'batch_max_concurrency', None)),
+        max_queue=int(get_config_value('admission', 'batch_max_queue', None)),
+        initial_service_time=float(get_config_value('admission', 'batch_initial_service_time', None))
+    )
+}
+
+
+def classify_request(path: str, body: dict):
+    """
+    Classifies a request by the cost of the pipeline it will run.
+
+    Args:
+        path: Request path.
+        body: Parsed JSON body of the request.
+
+    Returns:
+        The lane name, or None when the request is not subject to admission control.
+    """
+    if not path.startswith("/v1/"):
+        return None
+    # A batch runs for as long as many text requests, it must not skew the text lane's service time
+    if path == "/v1/context/batch":
+        return BATCH_LANE
+    if not isinstance(body, dict):
+        return TEXT_LANE
+    if path.startswith("/v1/translation"):
+        input_data = body.get("input") or {}
+        output_data = body.get("output") or {}
+        if input_data.get("audio") or str(output_data.get("format") or "").strip().lower() == "audio":
+            return AUDIO_LANE
+        return TEXT_LANE
+    if body.get("audio"):
+        return AUDIO_LANE
+    return TEXT_LANE
+
+
+def get_admission_metrics():
+    return {name: lane.metrics() for name, lane in lanes.items()}
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware admitting /v1 requests into the lane of their class, or shedding them with HTTP 429. The slot is
+    held until the response is sent completely and its background tasks are done, so that a streamed response
+    counts against the lane's concurrency limit and service time for as long as it runs.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not admission_enabled or scope["type"] != "http" or not scope["path"].startswith("/v1/"):
+            await self.app(scope, receive, send)
+            return
+
+        messages = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            messages.append(message)
+            more_body = message.get("more_body", False)
+
+        async def replay_receive():
+            if messages:
+                return messages.pop(0)
+            return await receive()
+
+        body = b"".join(message.get("body", b"") for message in messages)
+        try:
+            body = json.loads(body) if body else {}
+        except ValueError:
+            body = {}
+        lane = lanes.get(classify_request(scope["path"], body))
+        if lane is None:
+            await self.app(scope, replay_receive, send)
+            return
+
+        with span("queue"):
+            admitted = await lane.acquire()
+        if not admitted:
+            retry_after = lane.retry_after()
+            logger.warning({"label": "request_shed", "lane": lane.name, "retry_after": retry_after})
+            response = JSONResponse(status_code=429,
+                                    content={"detail": "Service is busy! Please retry after some time."},
+                                    headers={"Retry-After": str(retry_after)})
+            await response(scope, replay_receive, send)
+            return
+        start_time = time.time()
+        try:
+            # Returns once the last body message is sent and the response's background tasks are done
+            await self.app(scope, replay_receive, send)
+        finally:
+            lane.release(time.time() - start_time)
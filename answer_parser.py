@@ -0,0 +1,183 @@
+import json
+import re
+
+from logger import logger
+
+answer_start_pattern = re.compile(r'"answer"\s*:\s*\{')
+numbered_answer_pattern = re.compile(r'"answer_(\d+)"\s*:\s*(?=\{)')
+allowed_values_pattern = re.compile(r"'(\w+)' values in answer should always contain values from (\[.*?\])", re.DOTALL)
+
+
+class AnswerStreamParser:
+    """
+    Incremental parser which finds the "answer" object in a streamed LLM completion. The object is complete as soon
+    as its closing brace arrives, so the rest of the completion (e.g. trailing prose) does not need to be waited for.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.answer = None
+        self._start = None
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text):
+        """
+        Adds a chunk of the completion.
+
+        Returns:
+            The answer dict once the answer object is closed, else None.
+        """
+        self.buffer += text
+        while self.answer is None:
+            if self._start is None:
+                match = answer_start_pattern.search(self.buffer, self._position)
+                if match is None:
+                    # Keep a tail to catch the key when it is split across chunks
+                    self._position = max(self._position, len(self.buffer) - 32)
+                    return None
+                self._start = match.end() - 1
+                self._position = self._start
+                self._depth = 0
+                self._in_string = False
+                self._escaped = False
+            end = self._scan()
+            if end is None:
+                return None
+            try:
+                self.answer = json.loads(self.buffer[self._start:end + 1])
+            except ValueError:
+                logger.warning({"label": "llm_answer_parse_failed", "answer": self.buffer[self._start:end + 1]})
+                self._start = None
+                self._position = end + 1
+        return self.answer
+
+    def _scan(self):
+        for index in range(self._position, len(self.buffer)):
+            char = self.buffer[index]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    return index
+        self._position = len(self.buffer)
+        return None
+
+
+def parse_answer(content):
+    """
+    Extracts the "answer" object from a complete LLM completion, ignoring any text around it.
+    """
+    if not content:
+        return None
+    return AnswerStreamParser().feed(content)
+
+
+def parse_numbered_answers(content):
+    """
+    Extracts the numbered answer objects ("answer_1": {...}, "answer_2": {...}) of a completion answering several
+    questions at once.
+
+    Returns:
+        A dict mapping the question numbers to their answer dicts. Answers which cannot be parsed are left out.
+    """
+    answers = {}
+    decoder = json.JSONDecoder()
+    for match in numbered_answer_pattern.finditer(content or ""):
+        try:
+            answer, _ = decoder.raw_decode(content, match.end())
+        except ValueError:
+            logger.warning({"label": "llm_answer_parse_failed", "answer": content[match.start():match.start() + 200]})
+            continue
+        answers.setdefault(int(match.group(1)), answer)
+    return answers
+
+
+def parse_allowed_values(instructions):
+    """
+    Reads the allowed values of each answer attribute from the few-shot instructions.
+    """
+    allowed_values = {}
+    for key, values in allowed_values_pattern.findall(instructions):
+        try:
+            allowed_values[key] = json.loads(values)
+        except ValueError:
+            logger.warning({"label": "invalid_allowed_values", "key": key})
+    return allowed_values
+
+
+def find_answer_issues(answer, allowed_values):
+    """
+    Checks an answer for schema conformance, allowed values and self-consistency.
+
+    Returns:
+        A list of the issues found, empty if the answer can be trusted.
+    """
+    if not isinstance(answer, dict):
+        return ["missing answer"]
+    issues = []
+    for key in list(allowed_values) + ["keywords"]:
+        if key not in answer:
+            issues.append(f"missing attribute: {key}")
+    for key, values in answer.items():
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            issues.append(f"attribute is not a list of strings: {key}")
+            continue
+        if len(set(values)) != len(values):
+            issues.append(f"duplicate values: {key}")
+        if "Any" in values and len(values) > 1:
+            issues.append(f"'Any' mixed with specific values: {key}")
+        if key in allowed_values:
+            for value in values:
+                if match_allowed_value(value, allowed_values[key]) is None:
+                    issues.append(f"value not allowed: {key}={value}")
+    return issues
+
+
+def validate_answer(answer, allowed_values):
+    """
+    Normalizes every attribute of the answer to a list and drops the values outside of the attribute's allowed
+    values. Attributes left without any valid value fall back to ["Any"].
+    """
+    if not isinstance(answer, dict):
+        return None
+    validated = {}
+    for key, values in answer.items():
+        if not isinstance(values, list):
+            values = [values]
+        values = [str(value).strip() for value in values if value is not None and str(value).strip()]
+        if key in allowed_values:
+            valid_values = []
+            for value in values:
+                allowed_value = match_allowed_value(value, allowed_values[key])
+                if allowed_value is None:
+                    logger.info({"label": "llm_answer_invalid_value", "key": key, "value": value})
+                elif allowed_value not in valid_values:
+                    valid_values.append(allowed_value)
+            values = valid_values or ["Any"]
+        validated[key] = values
+    return validated
+
+
+def match_allowed_value(value, allowed):
+    lowered = value.lower()
+    for allowed_value in allowed:
+        if allowed_value.lower() == lowered:
+            return allowed_value
+    # Curricular goals are often given by their code only, e.g. "CG-1"
+    for allowed_value in allowed:
+        if ":" in allowed_value and allowed_value.split(":")[0].lower() == lowered.split(":")[0].strip():
+            return allowed_value
+    return None
@@ -0,0 +1,95 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from config_util import get_config_value
+from deadline import DeadlineExceeded, stage_timeout
+from logger import logger
+from server_timing import span
+
+process_pool_size = int(get_config_value('audio', 'process_pool_size', None))
+max_pending_transforms = int(get_config_value('audio', 'max_pending_transforms', None))
+
+_pool = None
+_pool_lock = threading.Lock()
+# Transforms running or queued in the pool; further requests wait for a slot within their deadline
+_slots = threading.BoundedSemaphore(process_pool_size + max_pending_transforms)
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Workers are forked from a clean server process with pydub preloaded, instead of from the service
+            # process with its threads and clients
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(["audio_transform", "pydub"])
+            _pool = ProcessPoolExecutor(max_workers=process_pool_size, mp_context=context)
+        return _pool
+
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run_transform(func, *args):
+    """
+    Runs a CPU-bound audio transform of audio_transform.py in the process pool, so that it neither blocks the event
+    loop nor holds the GIL of the service process. Runs it inline when the pool is disabled.
+
+    Raises:
+        DeadlineExceeded: If no pool slot frees up or the transform does not finish within the request's deadline.
+    """
+    with span("transcode"):
+        return _run_transform(func, *args)
+
+
+def _run_transform(func, *args):
+    if not process_pool_size:
+        return func(*args)
+    if not _slots.acquire(timeout=stage_timeout("transcode")):
+        raise DeadlineExceeded("transcode", "audio transform queue is full")
+    pool = get_pool()
+    try:
+        future = pool.submit(func, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    # The slot is held until the worker is done, even if the request stops waiting for it
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=stage_timeout("transcode"))
+    except FutureTimeoutError as e:
+        future.cancel()
+        raise DeadlineExceeded("transcode", "audio transform timed out") from e
+    except BrokenProcessPool:
+        logger.error("Audio transform worker died, restarting the process pool")
+        _discard_pool(pool)
+        raise
+
+
+def warm_up_pool():
+    """
+    Starts the pool's worker processes, so that the first audio requests do not wait for them.
+    """
+    from audio_transform import warm_up
+
+    if not process_pool_size:
+        warm_up()
+        return
+    pool = get_pool()
+    for future in [pool.submit(warm_up) for _ in range(process_pool_size)]:
+        future.result()
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,403 @@
+"""
+Header-only audio probe. Finds the container, codec, sample rate, channels and estimated duration of an audio input
+from its first bytes, so that unsupported or over-limit inputs are rejected before they are downloaded in full or
+decoded, and the normalizer can choose the cheapest decode path.
+"""
+import base64
+import binascii
+import re
+import struct
+
+from config_util import get_config_value
+
+max_audio_bytes = int(get_config_value('audio', 'max_audio_bytes', None))
+max_audio_duration = float(get_config_value('audio', 'max_duration_seconds', None))
+probe_bytes = int(get_config_value('audio', 'probe_bytes', None))
+reject_unknown_formats = get_config_value('audio', 'reject_unknown_formats', None).lower() == "true"
+base64_pattern = re.compile(r"[A-Za-z0-9+/]*={0,2}")
+
+MPEG_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+MPEG_BITRATES = {
+    (3, 3): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (3, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (3, 1): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 3): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+AAC_SAMPLE_RATES = (96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350)
+# Frame sizes in bytes, including the table of contents byte, by frame type
+AMR_NB_FRAME_SIZES = (13, 14, 16, 18, 20, 21, 27, 32, 6)
+AMR_WB_FRAME_SIZES = (18, 24, 33, 37, 41, 47, 51, 59, 61, 6)
+WAV_CODECS = {3: "pcm_f32le", 6: "pcm_alaw", 7: "pcm_mulaw"}
+# Consecutive frames an MPEG audio stream is recognized by
+MIN_MPEG_FRAMES = 3
+ASF_HEADER_GUID = bytes.fromhex("3026b2758e66cf11a6d900aa0062ce6c")
+ASF_FILE_PROPERTIES_GUID = bytes.fromhex("a1dcab8c47a9cf118ee400c00c205365")
+
+
+class AudioRejected(Exception):
+    """
+    Raised for audio inputs which are invalid, unsupported or over the configured limits.
+    """
+
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def probe_result(container, codec=None, sample_rate=None, channels=None, bits_per_sample=None, duration=None):
+    return {"container": container, "codec": codec, "sample_rate": sample_rate, "channels": channels,
+            "bits_per_sample": bits_per_sample, "duration": duration}
+
+
+def probe_wav(header, size):
+    position = 12
+    fmt = None
+    while position + 8 <= len(header):
+        chunk_id, chunk_size = struct.unpack_from("<4sI", header, position)
+        if chunk_id == b"fmt " and position + 24 <= len(header):
+            fmt = struct.unpack_from("<HHIIHH", header, position + 8)
+            if fmt[0] == 0xFFFE and position + 34 <= len(header):
+                # WAVE_FORMAT_EXTENSIBLE, the format is the start of the sub format GUID
+                fmt = (struct.unpack_from("<H", header, position + 32)[0],) + fmt[1:]
+        elif chunk_id == b"data":
+            break
+        position += 8 + chunk_size + (chunk_size & 1)
+    if fmt is None:
+        return probe_result("wav")
+    audio_format, channels, sample_rate, byte_rate, _, bits_per_sample = fmt
+    if audio_format == 1:
+        codec = "pcm_u8" if bits_per_sample == 8 else f"pcm_s{bits_per_sample}le"
+    else:
+        codec = WAV_CODECS.get(audio_format, f"wav_0x{audio_format:04x}")
+    # Streamed recordings leave the data size at 0 or its maximum, the file size is used instead
+    data_size = size - position - 8
+    if position + 8 <= len(header):
+        declared_size = struct.unpack_from("<I", header, position + 4)[0]
+        if 0 < declared_size < 0xFFFFFFFF:
+            data_size = min(declared_size, data_size)
+    duration = max(data_size, 0) / byte_rate if byte_rate else None
+    return probe_result("wav", codec, sample_rate, channels, bits_per_sample, duration)
+
+
+def parse_mpeg_frame(header, position):
+    """
+    Returns:
+        The MPEG audio version, layer, bitrate in kbit/s, sample rate and channels of the frame header at the
+        position, or None if there is no valid frame header.
+    """
+    if position + 4 > len(header) or header[position] != 0xFF or header[position + 1] & 0xE0 != 0xE0:
+        return None
+    version = (header[position + 1] >> 3) & 3
+    layer = (header[position + 1] >> 1) & 3
+    bitrate_index = header[position + 2] >> 4
+    sample_rate_index = (header[position + 2] >> 2) & 3
+    if version == 1 or layer == 0 or bitrate_index == 15 or sample_rate_index == 3:
+        return None
+    bitrate = MPEG_BITRATES[(3 if version == 3 else 2, layer if version == 3 or layer == 3 else 2)][bitrate_index]
+    sample_rate = MPEG_SAMPLE_RATES[version][sample_rate_index]
+    channels = 1 if header[position + 3] >> 6 == 3 else 2
+    return version, layer, bitrate, sample_rate, channels
+
+
+def mpeg_frame_length(version, layer, bitrate, sample_rate, padding):
+    if layer == 3:
+        return (12 * bitrate * 1000 // sample_rate + padding) * 4
+    if layer == 1 and version != 3:
+        return 72 * bitrate * 1000 // sample_rate + padding
+    return 144 * bitrate * 1000 // sample_rate + padding
+
+
+def mpeg_frame_chain(header, size, position, frame):
+    """
+    Returns:
+        Whether the frame header at the position is followed by MIN_MPEG_FRAMES - 1 frames of the same stream,
+        as far as the header reaches.
+    """
+    version, layer, bitrate, sample_rate, _ = frame
+    for checked in range(MIN_MPEG_FRAMES - 1):
+        padding = (header[position + 2] >> 1) & 1
+        position += mpeg_frame_length(version, layer, bitrate, sample_rate, padding)
+        if position + 4 > len(header):
+            # Past the end of the header the chain is trusted if it has a second frame, or if the file ends there
+            return checked > 0 or position == size
+        next_frame = parse_mpeg_frame(header, position)
+        if next_frame is None or next_frame[:2] != (version, layer) or next_frame[3] != sample_rate \
+                or not next_frame[2]:
+            return False
+        bitrate = next_frame[2]
+    return True
+
+
+def probe_mpeg(header, size):
+    start = 0
+    if header[:3] == b"ID3" and len(header) >= 10:
+        # The tag size is a 28 bit syncsafe integer
+        start = 10 + (header[6] << 21 | header[7] << 14 | header[8] << 7 | header[9])
+        if start >= len(header):
+            # A large tag, e.g. with cover art, hides the first frame from the probe
+            return probe_result("mp3", "mp3")
+    for position in range(start, min(len(header) - 4, start + 4096)):
+        frame = parse_mpeg_frame(header, position)
+        # Free format frames have no length to check the next frame against, and are hardly ever used
+        if frame is None or not frame[2]:
+            continue
+        # A frame sync pattern is common in other data, a frame header is only trusted when the next frames
+        # start where they should
+        if not mpeg_frame_chain(header, size, position, frame):
+            continue
+        version, layer, bitrate, sample_rate, channels = frame
+        codec = {1: "mp3", 2: "mp2", 3: "mp1"}[layer]
+        samples_per_frame = 384 if layer == 3 else 1152 if layer == 2 or version == 3 else 576
+        duration = (size - position) * 8 / (bitrate * 1000)
+        # Variable bitrate files carry their number of frames in a Xing or Info header in the first frame
+        side_info = (32 if channels == 2 else 17) if version == 3 else (17 if channels == 2 else 9)
+        xing = position + 4 + side_info
+        if header[xing:xing + 4] in (b"Xing", b"Info") and xing + 12 <= len(header):
+            flags, frames = struct.unpack_from(">II", header, xing + 4)
+            if flags & 1:
+                duration = frames * samples_per_frame / sample_rate
+        return probe_result("mp3", codec, sample_rate, channels, None, duration)
+    return None
+
+
+def probe_adts(header, size):
+    if len(header) < 7:
+        return None
+    sample_rate_index = (header[2] >> 2) & 0xF
+    if sample_rate_index >= len(AAC_SAMPLE_RATES):
+        return None
+    sample_rate = AAC_SAMPLE_RATES[sample_rate_index]
+    channels = ((header[2] & 1) << 2) | (header[3] >> 6)
+    # Frame sizes vary too much to estimate the duration from the first one
+    return probe_result("aac", "aac", sample_rate, channels or None)
+
+
+def probe_ogg(header, size):
+    if len(header) < 28:
+        return probe_result("ogg")
+    packet = header[27 + header[26]:]
+    if packet[:7] == b"\x01vorbis" and len(packet) >= 24:
+        # The nominal bitrate is too far off the actual one to estimate the duration, it is left to the size limit
+        channels, sample_rate = struct.unpack_from("<BI", packet, 11)
+        return probe_result("ogg", "vorbis", sample_rate, channels)
+    if packet[:8] == b"OpusHead" and len(packet) >= 16:
+        channels = packet[9]
+        input_sample_rate = struct.unpack_from("<I", packet, 12)[0]
+        return probe_result("ogg", "opus", input_sample_rate or 48000, channels)
+    if packet[:5] == b"\x7fFLAC":
+        return probe_result("ogg", "flac")
+    return probe_result("ogg")
+
+
+def probe_flac(header, size):
+    # STREAMINFO is always the first metadata block
+    if len(header) < 26 or header[4] & 0x7F != 0:
+        return probe_result("flac", "flac")
+    info = int.from_bytes(header[18:26], "big")
+    sample_rate = info >> 44
+    channels = ((info >> 41) & 7) + 1
+    bits_per_sample = ((info >> 36) & 0x1F) + 1
+    total_samples = info & 0xFFFFFFFFF
+    duration = total_samples / sample_rate if sample_rate and total_samples else None
+    return probe_result("flac", "flac", sample_rate, channels, bits_per_sample, duration)
+
+
+def iter_boxes(header, start, end):
+    position = start
+    while position + 8 <= min(end, len(header)):
+        box_size, box_type = struct.unpack_from(">I4s", header, position)
+        header_size = 8
+        if box_size == 1 and position + 16 <= len(header):
+            box_size = struct.unpack_from(">Q", header, position + 8)[0]
+            header_size = 16
+        elif box_size == 0:
+            box_size = end - position
+        if box_size < header_size:
+            return
+        yield box_type, position + header_size, position + box_size
+        position += box_size
+
+
+def probe_mp4(header, size):
+    for box_type, start, end in iter_boxes(header, 0, size):
+        if box_type != b"moov":
+            continue
+        moov = header[start:end]
+        codec = next((name for name, tag in (("aac", b"mp4a"), ("amr_nb", b"samr"), ("amr_wb", b"sawb"),
+                                             ("opus", b"Opus"), ("alac", b"alac")) if tag in moov), None)
+        for child_type, child_start, _ in iter_boxes(header, start, end):
+            if child_type == b"mvhd" and child_start + 32 <= len(header):
+                if header[child_start] == 1:
+                    timescale, duration = struct.unpack_from(">IQ", header, child_start + 20)
+                else:
+                    timescale, duration = struct.unpack_from(">II", header, child_start + 12)
+                return probe_result("mp4", codec, duration=duration / timescale if timescale else None)
+        return probe_result("mp4", codec)
+    # The moov box is often written at the end of the file
+    return probe_result("mp4")
+
+
+def read_ebml_float(header, element_id):
+    position = header.find(element_id)
+    if position < 0 or position + len(element_id) + 1 > len(header):
+        return None
+    value_start = position + len(element_id) + 1
+    if header[value_start - 1] == 0x84 and value_start + 4 <= len(header):
+        return struct.unpack_from(">f", header, value_start)[0]
+    if header[value_start - 1] == 0x88 and value_start + 8 <= len(header):
+        return struct.unpack_from(">d", header, value_start)[0]
+    return None
+
+
+def probe_webm(header, size):
+    container = "webm" if b"webm" in header[:64] else "matroska"
+    codec = next((name for name, codec_id in (("opus", b"A_OPUS"), ("vorbis", b"A_VORBIS"), ("aac", b"A_AAC"),
+                                              ("pcm", b"A_PCM")) if codec_id in header), None)
+    timecode_scale = 1000000
+    position = header.find(b"\x2a\xd7\xb1")
+    if 0 <= position and position + 4 <= len(header) and 0x81 <= header[position + 3] <= 0x88:
+        length = header[position + 3] & 0x7F
+        timecode_scale = int.from_bytes(header[position + 4:position + 4 + length], "big") or timecode_scale
+    duration = read_ebml_float(header, b"\x44\x89")
+    sample_rate = None
+    codec_position = header.find(b"A_")
+    if codec_position >= 0:
+        sample_rate = read_ebml_float(header[codec_position:], b"\xb5")
+    return probe_result(container, codec, int(sample_rate) if sample_rate else None,
+                        duration=duration * timecode_scale / 1e9 if duration else None)
+
+
+def probe_aiff(header, size):
+    codec = "pcm_s16be" if header[8:12] == b"AIFF" else None
+    position = 12
+    while position + 8 <= len(header):
+        chunk_id, chunk_size = struct.unpack_from(">4sI", header, position)
+        if chunk_id == b"COMM" and position + 26 <= len(header):
+            channels, frames, bits_per_sample = struct.unpack_from(">hIh", header, position + 8)
+            # The sample rate is an 80 bit extended precision float
+            exponent, mantissa = struct.unpack_from(">HQ", header, position + 16)
+            sample_rate = mantissa * 2.0 ** ((exponent & 0x7FFF) - 16383 - 63) if mantissa else 0
+            if header[8:12] == b"AIFF":
+                codec = f"pcm_s{bits_per_sample}be"
+            duration = frames / sample_rate if sample_rate else None
+            return probe_result("aiff", codec, int(sample_rate) or None, channels, bits_per_sample, duration)
+        position += 8 + chunk_size + (chunk_size & 1)
+    return probe_result("aiff", codec)
+
+
+def probe_asf(header, size):
+    # Objects of the header start after its own 30 bytes, each with a GUID and a 64 bit size
+    position = 30
+    while position + 24 <= len(header):
+        object_id = header[position:position + 16]
+        object_size = struct.unpack_from("<Q", header, position + 16)[0]
+        if object_id == ASF_FILE_PROPERTIES_GUID and position + 88 <= len(header):
+            # The play duration is in 100 ns units and includes the preroll, given in milliseconds
+            play_duration, _, preroll = struct.unpack_from("<QQQ", header, position + 64)
+            duration = play_duration / 1e7 - preroll / 1000 if play_duration else None
+            return probe_result("asf", duration=duration if duration is None or duration > 0 else None)
+        if object_size < 24:
+            break
+        position += object_size
+    return probe_result("asf")
+
+
+def probe_amr(header, size):
+    wideband = header.startswith(b"#!AMR-WB\n")
+    header_size = 9 if wideband else 6
+    frame_sizes = AMR_WB_FRAME_SIZES if wideband else AMR_NB_FRAME_SIZES
+    duration = None
+    if len(header) > header_size:
+        frame_type = (header[header_size] >> 3) & 0xF
+        if frame_type < len(frame_sizes):
+            duration = (size - header_size) / frame_sizes[frame_type] * 0.02
+    return probe_result("amr", "amr_wb" if wideband else "amr_nb", 16000 if wideband else 8000, 1, None, duration)
+
+
+def probe_audio(header, size=None):
+    """
+    Probes the container and stream parameters of an audio file from its first bytes.
+
+    Args:
+        header: The first bytes of the file, probe_bytes are enough.
+        size: The size of the whole file, used to estimate the duration. Defaults to the length of the header.
+
+    Returns:
+        A dict with the container, codec, sample_rate, channels, bits_per_sample and estimated duration in seconds,
+        the parameters which cannot be found from the header being None, or None if the format is not recognized.
+    """
+    size = len(header) if size is None else size
+    if header[:4] in (b"RIFF", b"RF64") and header[8:12] == b"WAVE":
+        return probe_wav(header, size)
+    if header[:4] == b"OggS":
+        return probe_ogg(header, size)
+    if header[:4] == b"fLaC":
+        return probe_flac(header, size)
+    if header[4:8] == b"ftyp":
+        return probe_mp4(header, size)
+    if header[:4] == b"\x1a\x45\xdf\xa3":
+        return probe_webm(header, size)
+    if header.startswith(b"#!AMR"):
+        return probe_amr(header, size)
+    if header[:4] == b"FORM" and header[8:12] in (b"AIFF", b"AIFC"):
+        return probe_aiff(header, size)
+    if header[:16] == ASF_HEADER_GUID:
+        return probe_asf(header, size)
+    if len(header) >= 2 and header[0] == 0xFF and header[1] & 0xF6 == 0xF0:
+        return probe_adts(header, size)
+    return probe_mpeg(header, size)
+
+
+def check_audio(header, size):
+    """
+    Probes an audio input and checks it against the configured limits.
+
+    Returns:
+        The probe result, None for an unrecognized format when those are allowed, to be decoded by ffmpeg.
+
+    Raises:
+        AudioRejected: If the input is larger or longer than allowed, or its format is not supported.
+    """
+    if size > max_audio_bytes:
+        raise AudioRejected(413, f"Audio is larger than {max_audio_bytes // (1024 * 1024)} MB!")
+    probe = probe_audio(header, size)
+    if probe is None:
+        if reject_unknown_formats:
+            raise AudioRejected(415, "Unsupported audio format!")
+        return None
+    if probe["duration"] is not None and probe["duration"] > max_audio_duration:
+        raise AudioRejected(413, f"Audio is longer than {max_audio_duration:g} seconds!")
+    return probe
+
+
+def check_content_headers(content_type, content_length):
+    """
+    Checks the headers of an audio download before its body is read.
+
+    Raises:
+        AudioRejected: If the announced content is larger than allowed or not audio.
+    """
+    if content_length is not None and content_length.isdigit() and int(content_length) > max_audio_bytes:
+        raise AudioRejected(413, f"Audio is larger than {max_audio_bytes // (1024 * 1024)} MB!")
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type.startswith(("text/", "image/")) or media_type in ("application/json", "application/xml"):
+        raise AudioRejected(415, "Unsupported audio format!")
+
+
+def check_encoded_audio(encoded_audio):
+    """
+    Checks base64 encoded audio, decoding only the prefix needed by the probe.
+    """
+    prefix = "".join(encoded_audio[:probe_bytes // 3 * 4 + 64].split())
+    if not base64_pattern.fullmatch(prefix):
+        raise AudioRejected(422, "Invalid audio input!")
+    prefix = prefix[:min(len(prefix), probe_bytes // 3 * 4) // 4 * 4]
+    try:
+        header = base64.b64decode(prefix)
+    except (binascii.Error, ValueError):
+        raise AudioRejected(422, "Invalid audio input!")
+    tail = encoded_audio[-2:]
+    size = len(encoded_audio) * 3 // 4 - (len(tail) - len(tail.rstrip("=")))
+    return check_audio(header, size)
@@ -0,0 +1,56 @@
+"""
+CPU-bound audio transforms, run in the worker processes of audio_pool.py. The functions only take and return bytes
+and strings, so that they can be sent to another process, and this module must not import the service's
+configuration, clients or logging.
+"""
+import base64
+import io
+
+
+def normalize_audio(audio_content, probe=None):
+    """
+    Converts audio of any format supported by ffmpeg into the 16 kHz mono 16 bit PCM WAV expected by Bhashini ASR.
+    The probe result of audio_probe.py selects the cheapest decode path: 16 kHz mono 16 bit PCM WAV is used as it
+    is, other 16 bit PCM WAV is converted without ffmpeg and only the other formats go through ffmpeg.
+
+    Returns:
+        The base64 encoded WAV as a string and the WAV content.
+    """
+    from pydub import AudioSegment
+
+    is_pcm_wav = probe is not None and probe["container"] == "wav" and probe["codec"] == "pcm_s16le"
+    if is_pcm_wav and probe["sample_rate"] == 16000 and probe["channels"] == 1:
+        wav_file_content = audio_content
+    elif is_pcm_wav:
+        given_audio = AudioSegment.from_wav(io.BytesIO(audio_content))
+        given_audio = given_audio.set_frame_rate(16000).set_channels(1)
+        wav_file_content = given_audio.export(io.BytesIO(), format="wav").read()
+    else:
+        given_audio = AudioSegment.from_file(io.BytesIO(audio_content))
+        mp3_output_file = given_audio.export(io.BytesIO(), format="mp3")
+        given_audio = AudioSegment.from_file(mp3_output_file)
+        given_audio = given_audio.set_frame_rate(16000)
+        given_audio = given_audio.set_channels(1)
+        wav_file_content = given_audio.export(io.BytesIO(), format="wav", codec="pcm_s16le").read()
+    encoded_string = str(base64.b64encode(wav_file_content), 'ascii', 'ignore')
+    return encoded_string, wav_file_content
+
+
+def normalize_encoded_audio(encoded_audio, probe=None):
+    """
+    Same as normalize_audio, for base64 encoded audio.
+    """
+    return normalize_audio(base64.b64decode(encoded_audio), probe)
+
+
+def encode_mp3(audio_content):
+    """
+    Encodes synthesized speech as MP3, whose frames can be played while they arrive and concatenated.
+    """
+    from pydub import AudioSegment
+
+    return AudioSegment.from_file(io.BytesIO(audio_content)).export(io.BytesIO(), format="mp3").read()
+
+
+def warm_up():
+    from pydub import AudioSegment  # noqa: F401
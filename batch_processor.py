@@ -0,0 +1,203 @@
+"""
+Offline bulk translation and TTS runner.
+
+Processes a JSONL or CSV file of items with the same pipeline functions as /v1/translation, without going through
+the API. Every item has the fields:
+
+    id, text or audio, source_language, target_language, format ("text" or "audio")
+
+Missing language and format fields are taken from the command line. Results are appended to a JSONL output file,
+one line per item with the translated text and, for the audio format, the published audio URL. Progress is
+checkpointed after every batch, so that a crashed run resumes where it stopped when started again.
+
+    python batch_processor.py items.jsonl --output results.jsonl --source-language en --target-language hi \
+        --format audio --concurrency 8 --batch-size 64
+"""
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from io_processing import convert_text_to_audio, publish_audio_file, translate_audio
+from logger import logger
+from translator import indic_translation_batch
+
+
+def read_items(input_path):
+    """
+    Streams the items of a JSONL or CSV file, and a ValueError in place of each line which is not a valid item.
+    """
+    with open(input_path, newline="", encoding="utf-8") as input_file:
+        if input_path.lower().endswith(".csv"):
+            for row in csv.DictReader(input_file):
+                yield {key: value for key, value in row.items() if value not in (None, "")}
+        else:
+            for line_number, line in enumerate(input_file, 1):
+                if not line.strip():
+                    continue
+                # A malformed line is yielded as an error, so that it gets a result and the checkpoint moves past it
+                try:
+                    item = json.loads(line)
+                except ValueError as e:
+                    yield ValueError(f"Invalid JSON on line {line_number}: {e}")
+                    continue
+                yield item if isinstance(item, dict) else ValueError(f"Line {line_number} is not a JSON object")
+
+
+def load_checkpoint(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return {"items": 0, "output_offset": None}
+    with open(checkpoint_path) as checkpoint_file:
+        return json.load(checkpoint_file)
+
+
+def save_checkpoint(checkpoint_path, checkpoint):
+    temp_path = checkpoint_path + ".tmp"
+    with open(temp_path, "w") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(temp_path, checkpoint_path)
+
+
+class BatchProcessor:
+    def __init__(self, args):
+        self.args = args
+        self.executor = ThreadPoolExecutor(max_workers=args.concurrency)
+        self.semaphore = asyncio.Semaphore(args.concurrency)
+
+    def normalize(self, item, index):
+        if isinstance(item, ValueError):
+            return {"id": index, "text": None, "audio": None, "source_language": "", "target_language": "",
+                    "format": self.args.format, "error": str(item)}
+        return {
+            "id": item.get("id", index),
+            "text": item.get("text"),
+            "audio": item.get("audio"),
+            "source_language": (item.get("source_language") or self.args.source_language or "").lower(),
+            "target_language": (item.get("target_language") or self.args.target_language or "").lower(),
+            "format": (item.get("format") or self.args.format).lower(),
+            "error": None
+        }
+
+    async def run_blocking(self, func, *args, **kwargs):
+        async with self.semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, lambda: func(*args, **kwargs))
+
+    async def translate_texts(self, items):
+        """
+        Translates the text items of a batch, one Bhashini call per language pair and chunk.
+        """
+        translations = {}
+        text_items = sorted((item for item in items if item["text"]),
+                            key=lambda item: (item["source_language"], item["target_language"]))
+        calls = []
+        for (source, target), group in itertools.groupby(text_items,
+                                                         key=lambda item: (item["source_language"],
+                                                                           item["target_language"])):
+            group = list(group)
+            for start in range(0, len(group), self.args.translation_batch_size):
+                chunk = group[start:start + self.args.translation_batch_size]
+                calls.append((chunk, self.run_blocking(indic_translation_batch, [item["text"] for item in chunk],
+                                                       source, target)))
+        results = await asyncio.gather(*(call for _, call in calls), return_exceptions=True)
+        for (chunk, _), result in zip(calls, results):
+            for position, item in enumerate(chunk):
+                if isinstance(result, Exception):
+                    translations[id(item)] = (None, f"Translation failed: {result}")
+                else:
+                    translations[id(item)] = (result[position], None)
+        return translations
+
+    async def process_item(self, item, translation):
+        result = {"id": item["id"], "text": None, "audio": None, "error": item["error"]}
+        if item["error"]:
+            return result
+        if item["text"]:
+            result["text"], result["error"] = translation
+            if item["format"] == "audio" and result["text"] is not None:
+                output_file, result["error"] = await self.run_blocking(convert_text_to_audio, result["text"],
+                                                                       item["target_language"])
+                if output_file is not None:
+                    result["audio"], result["error"] = await self.run_blocking(publish_audio_file, output_file)
+        elif item["audio"]:
+            _, result["text"], output_file, result["error"] = await self.run_blocking(
+                translate_audio, item["audio"], item["source_language"], item["target_language"],
+                synthesize=item["format"] == "audio")
+            if output_file is not None:
+                result["audio"], result["error"] = await self.run_blocking(publish_audio_file, output_file)
+        else:
+            result["error"] = "Either 'text' or 'audio' should be present!"
+        return result
+
+    async def process_batch(self, items):
+        translations = await self.translate_texts(items)
+        results = await asyncio.gather(*(self.process_item(item, translations.get(id(item))) for item in items),
+                                       return_exceptions=True)
+        return [{"id": item["id"], "text": None, "audio": None, "error": str(result)}
+                if isinstance(result, Exception) else result
+                for item, result in zip(items, results)]
+
+    async def run(self):
+        args = self.args
+        checkpoint = load_checkpoint(args.checkpoint)
+        if checkpoint["items"]:
+            logger.info(f"Resuming after {checkpoint['items']} processed items")
+        items = read_items(args.input)
+        for _ in itertools.islice(items, checkpoint["items"]):
+            pass
+
+        start_time = time.time()
+        processed = failed = 0
+        with open(args.output, "a+b") as output_file:
+            if checkpoint["output_offset"] is not None:
+                # Drop results written after the last checkpoint by an interrupted run
+                output_file.truncate(checkpoint["output_offset"])
+            output_file.seek(0, os.SEEK_END)
+            while True:
+                batch = [self.normalize(item, checkpoint["items"] + index)
+                         for index, item in enumerate(itertools.islice(items, args.batch_size))]
+                if not batch:
+                    break
+                results = await self.process_batch(batch)
+                for result in results:
+                    output_file.write((json.dumps(result, ensure_ascii=False) + "\n").encode("utf-8"))
+                output_file.flush()
+                os.fsync(output_file.fileno())
+                checkpoint = {"items": checkpoint["items"] + len(batch), "output_offset": output_file.tell()}
+                save_checkpoint(args.checkpoint, checkpoint)
+
+                processed += len(batch)
+                failed += sum(1 for result in results if result["error"])
+                elapsed = time.time() - start_time
+                logger.info(f"Processed {processed} items ({failed} failed) in {elapsed:.1f}s, "
+                            f"{processed / elapsed:.2f} items/s")
+        self.executor.shutdown()
+        elapsed = time.time() - start_time
+        print(f"Processed {processed} items ({failed} failed) in {elapsed:.1f}s, "
+              f"{processed / elapsed if elapsed else 0:.2f} items/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL or CSV file with the items to process")
+    parser.add_argument("--output", required=True, help="JSONL file the results are appended to")
+    parser.add_argument("--checkpoint", help="checkpoint file, defaults to <output>.checkpoint")
+    parser.add_argument("--source-language", help="default source language of the items")
+    parser.add_argument("--target-language", help="default target language of the items")
+    parser.add_argument("--format", default="text", choices=["text", "audio"], help="default output format")
+    parser.add_argument("--concurrency", type=int, default=8, help="maximum number of concurrent upstream calls")
+    parser.add_argument("--batch-size", type=int, default=64, help="items processed between two checkpoints")
+    parser.add_argument("--translation-batch-size", type=int, default=16,
+                        help="texts translated in one Bhashini call")
+    args = parser.parse_args()
+    args.checkpoint = args.checkpoint or args.output + ".checkpoint"
+    asyncio.run(BatchProcessor(args).run())
+
+
+if __name__ == "__main__":
+    main()
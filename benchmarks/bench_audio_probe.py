@@ -0,0 +1,77 @@
+"""
+Audio probe benchmark: time to reject an over-limit base64 recording with the header-only probe against decoding and
+normalizing it, as before the probe, and the normalization time of WAV inputs on the ffmpeg path against the decode
+path chosen from the probe result. Needs ffmpeg.
+
+    python benchmarks/bench_audio_probe.py --minutes 20 --runs 5
+"""
+import argparse
+import base64
+import io
+import os
+import statistics
+import sys
+import time
+import wave
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def sine_wav(seconds, rate, channels):
+    frame = (1000).to_bytes(2, "little", signed=True) * channels
+    silence = b"\x00\x00" * channels
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        wav_file.writeframes((frame * 20 + silence * 20) * int(seconds * rate / 40))
+    return buffer.getvalue()
+
+
+def timed(func, runs):
+    timings = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start_time)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, default=20, help="length of the over-limit recording")
+    parser.add_argument("--seconds", type=float, default=10, help="length of the accepted recordings")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    os.environ.update({"max_audio_bytes": str(1 << 30)})
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    from audio_probe import AudioRejected, check_encoded_audio, probe_audio
+    from audio_transform import normalize_audio, normalize_encoded_audio
+
+    long_audio = base64.b64encode(sine_wav(args.minutes * 60, 16000, 1)).decode("ascii")
+
+    def reject():
+        try:
+            check_encoded_audio(long_audio)
+        except AudioRejected:
+            return
+        raise AssertionError("the recording was not rejected")
+
+    print(f"over-limit recording, {args.minutes:g} minutes, {len(long_audio) / 1e6:.1f} MB of base64")
+    print(f"  decode and normalize (before)  {timed(lambda: normalize_encoded_audio(long_audio), 1) * 1000:>10.1f} ms")
+    print(f"  header-only probe              {timed(reject, args.runs) * 1000:>10.3f} ms")
+
+    print(f"normalization of {args.seconds:g} second recordings")
+    print(f"  {'input':<24}{'ffmpeg':>10}{'probed':>10}")
+    for label, rate, channels in (("16 kHz mono WAV", 16000, 1), ("44.1 kHz stereo WAV", 44100, 2)):
+        audio_content = sine_wav(args.seconds, rate, channels)
+        probe = probe_audio(audio_content[:65536], len(audio_content))
+        ffmpeg_time = timed(lambda: normalize_audio(audio_content), args.runs)
+        probed_time = timed(lambda: normalize_audio(audio_content, probe), args.runs)
+        print(f"  {label:<24}{ffmpeg_time * 1000:>8.1f}ms{probed_time * 1000:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
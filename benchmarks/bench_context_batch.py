@@ -0,0 +1,73 @@
+"""
+Batched context benchmark: wall time and upstream calls of one /v1/context/batch request against the same queries
+sent one by one to /v1/context, using the local stub upstreams. Half of the queries are in Hindi, to include the
+translation to English.
+
+    python benchmarks/bench_context_batch.py --queries 40 --llm-latency 1.0
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_upstreams import start_stub  # noqa: E402
+
+ANSWER = ('"answer": {"category": ["Activities"], "persona": ["Parent"], "age": ["3-5"], "format": ["Any"], '
+          '"keywords": ["water painting"], "domain": ["Aesthetic and Cultural Development"], '
+          '"curricularGoal": ["CG-12"]}')
+
+
+def count_requests(state, start):
+    requests = state.requests[start:]
+    return (sum("/chat/completions" in request["path"] for request in requests),
+            sum(request["path"].startswith("/services/inference/pipeline") for request in requests))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=40)
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="fixed latency of an LLM call in seconds")
+    parser.add_argument("--llm-latency-per-answer", type=float, default=0.1)
+    parser.add_argument("--translation-latency", type=float, default=0.1)
+    args = parser.parse_args()
+
+    script = {"chat": {"stub-gpt": {"latency": args.llm_latency, "latency_per_answer": args.llm_latency_per_answer,
+                                    "responses": [ANSWER]}},
+              "bhashini": {"latency": {"translation": args.translation_latency}}}
+    server, state, url = start_stub(script)
+    os.environ.update({"OPENAI_API_BASE": url, "OPENAI_API_KEY": "stub", "OPENAI_API_VERSION": "2024-02-01",
+                       "gpt_model": "stub-gpt",
+                       "BHASHINI_ENDPOINT_URL": f"{url}/services/inference/pipeline", "BHASHINI_API_KEY": "stub",
+                       "telemetry_log_enabled": "false"})
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    from fastapi.testclient import TestClient
+    from main import app
+
+    items = [{"text": f"How do I teach water painting to my child at home, question {index}?",
+              "language": "hi" if index % 2 else "en"} for index in range(args.queries)]
+    with TestClient(app) as client:
+        start, start_time = len(state.requests), time.perf_counter()
+        for item in items:
+            client.post("/v1/context", json=item).raise_for_status()
+        sequential = time.perf_counter() - start_time, *count_requests(state, start)
+
+        start, start_time = len(state.requests), time.perf_counter()
+        response = client.post("/v1/context/batch", json={"items": items})
+        response.raise_for_status()
+        batch = time.perf_counter() - start_time, *count_requests(state, start)
+        answered = sum(result["context"] is not None for result in response.json()["items"])
+    server.shutdown()
+
+    print(f"{args.queries} queries, {answered} answered in the batch")
+    print(f"{'mode':<24}{'total':>9}{'LLM calls':>11}{'MT calls':>10}")
+    for label, (total, llm_calls, translation_calls) in (("sequential /v1/context", sequential),
+                                                        ("/v1/context/batch", batch)):
+        print(f"{label:<24}{total:>8.2f}s{llm_calls:>11}{translation_calls:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Event loop benchmark: /health latency (a proxy for event loop lag) and throughput of a worker under mixed text and
+audio traffic, with the audio transforms run inline and in the process pool of audio_pool.py. The worker runs
+against the local stub upstreams, so ffmpeg is the only external dependency.
+
+    python benchmarks/bench_event_loop.py --duration 20 --clients 8 --audio-ratio 0.5 --pool-sizes 0,2
+"""
+import argparse
+import base64
+import io
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_upstreams import start_stub  # noqa: E402
+
+
+def make_audio(seconds):
+    from pydub.generators import Sine
+
+    audio = Sine(440).to_audio_segment(duration=seconds * 1000).set_frame_rate(44100)
+    return base64.b64encode(audio.export(io.BytesIO(), format="mp3").read()).decode("ascii")
+
+
+def wait_for(url, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.1)
+    raise TimeoutError(url)
+
+
+def run_load(base_url, args, audio):
+    text_request = {"text": "मेरे बच्चे को पानी से चित्रकारी कैसे सिखाएं", "language": "hi"}
+    audio_request = {"input": {"audio": audio, "language": "hi"}, "output": {"language": "en", "format": "text"}}
+    audio_every = round(1 / args.audio_ratio) if args.audio_ratio else 0
+    stop_time = time.perf_counter() + args.duration
+    counts = {"text": 0, "audio": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def client(index):
+        session = requests.Session()
+        count = index
+        while time.perf_counter() < stop_time:
+            count += 1
+            kind = "audio" if audio_every and count % audio_every == 0 else "text"
+            if kind == "audio":
+                response = session.post(f"{base_url}/v1/translation", json=audio_request, timeout=120)
+            else:
+                response = session.post(f"{base_url}/v1/context", json=text_request, timeout=120)
+            with lock:
+                counts[kind if response.status_code == 200 else "errors"] += 1
+
+    health_latencies = []
+
+    def probe():
+        session = requests.Session()
+        while time.perf_counter() < stop_time:
+            start_time = time.perf_counter()
+            session.get(f"{base_url}/health", timeout=30)
+            health_latencies.append(time.perf_counter() - start_time)
+            time.sleep(0.05)
+
+    with ThreadPoolExecutor(max_workers=args.clients + 1) as executor:
+        futures = [executor.submit(client, index) for index in range(args.clients)] + [executor.submit(probe)]
+        for future in futures:
+            future.result()
+    return counts, health_latencies
+
+
+def measure(pool_size, stub_url, args, audio):
+    env = dict(os.environ, process_pool_size=str(pool_size), OPENAI_API_BASE=stub_url, OPENAI_API_KEY="stub",
+               OPENAI_API_VERSION="2024-02-01", BHASHINI_ENDPOINT_URL=f"{stub_url}/services/inference/pipeline",
+               BHASHINI_API_KEY="stub", gpt_model="stub-large", fast_gpt_model="", admission_enabled="false",
+               telemetry_log_enabled="false", LOG_LEVEL="WARNING")
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port)], cwd=REPO_ROOT,
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        base_url = f"http://127.0.0.1:{args.port}"
+        wait_for(f"{base_url}/ready", 60)
+        return run_load(base_url, args, audio)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--audio-ratio", type=float, default=0.5, help="share of audio requests")
+    parser.add_argument("--audio-seconds", type=int, default=30)
+    parser.add_argument("--pool-sizes", default="0,2", help="process pool sizes to compare, 0 runs transforms inline")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    audio = make_audio(args.audio_seconds)
+    script = {
+        "chat": {"stub-large": {"latency": 0.3, "responses": ['"answer": {"keywords": ["water painting"]}']}},
+        "bhashini": {"latency": {"asr": 0.2, "translation": 0.1}}
+    }
+    server, _, stub_url = start_stub(script)
+    results = [(pool_size, *measure(pool_size, stub_url, args, audio))
+               for pool_size in (int(size) for size in args.pool_sizes.split(","))]
+    server.shutdown()
+
+    print(f"{args.clients} clients, {args.audio_ratio:.0%} audio requests of {args.audio_seconds}s MP3, "
+          f"{args.duration:.0f}s per run")
+    print(f"{'pool size':<11}{'text/s':>8}{'audio/s':>9}{'errors':>8}{'health p50':>12}{'health p99':>12}"
+          f"{'health max':>12}")
+    for pool_size, counts, latencies in results:
+        latencies = sorted(latencies)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"{pool_size:<11}{counts['text'] / args.duration:>8.2f}{counts['audio'] / args.duration:>9.2f}"
+              f"{counts['errors']:>8}{statistics.median(latencies) * 1000:>9.1f} ms{p99 * 1000:>9.1f} ms"
+              f"{latencies[-1] * 1000:>9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Idempotency benchmark: upstream LLM calls and client latency when clients retry their /v1/context requests, with
+and without an Idempotency-Key header, using the local stub upstreams. Every request is retried once while the
+first attempt is still running, like a client giving up after a timeout, and once after it completed.
+
+    python benchmarks/bench_idempotency.py --requests 10 --llm-latency 1.0
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_upstreams import start_stub  # noqa: E402
+
+ANSWER = ('"answer": {"category": ["Activities"], "persona": ["Parent"], "age": ["3-5"], "format": ["Any"], '
+          '"keywords": ["water painting"], "domain": ["Aesthetic and Cultural Development"], '
+          '"curricularGoal": ["CG-12"]}')
+
+
+def run(client, state, requests, retry_after, use_key):
+    start = len(state.requests)
+    latencies = []
+
+    def attempt(body, headers):
+        start_time = time.perf_counter()
+        client.post("/v1/context", json=body, headers=headers).raise_for_status()
+        latencies.append(time.perf_counter() - start_time)
+
+    def request(index):
+        body = {"text": f"How do I teach water painting to my child at home, question {index}?", "language": "en"}
+        headers = {"Idempotency-Key": uuid.uuid4().hex} if use_key else {}
+        first = threading.Thread(target=attempt, args=(body, headers))
+        first.start()
+        time.sleep(retry_after)
+        attempt(body, headers)
+        first.join()
+        attempt(body, headers)
+
+    threads = [threading.Thread(target=request, args=(index,)) for index in range(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum("/chat/completions" in request["path"] for request in state.requests[start:]), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--retry-after", type=float, default=0.5, help="seconds before the concurrent retry")
+    args = parser.parse_args()
+
+    server, state, url = start_stub({"chat": {"stub-gpt": {"latency": args.llm_latency, "responses": [ANSWER]}}})
+    os.environ.update({"OPENAI_API_BASE": url, "OPENAI_API_KEY": "stub", "OPENAI_API_VERSION": "2024-02-01",
+                       "gpt_model": "stub-gpt", "telemetry_log_enabled": "false"})
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    from fastapi.testclient import TestClient
+    from main import app
+
+    with TestClient(app) as client:
+        results = [(label, *run(client, state, args.requests, args.retry_after, use_key))
+                   for label, use_key in (("without key", False), ("with Idempotency-Key", True))]
+    server.shutdown()
+
+    print(f"{args.requests} requests, each sent 3 times")
+    print(f"{'mode':<22}{'LLM calls':>11}{'mean':>9}{'p50':>9}")
+    for label, llm_calls, latencies in results:
+        print(f"{label:<22}{llm_calls:>11}{statistics.mean(latencies):>8.3f}s{statistics.median(latencies):>8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+LLM cascade benchmark: latency and per-tier hit rates of the fast-model-first cascade against the large model
+alone, using the local stub chat completions server with scripted responses.
+
+    python benchmarks/bench_llm_cascade.py --questions 40 --bad-ratio 0.25
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_upstreams import start_stub  # noqa: E402
+
+GOOD_ANSWER = ('"answer": {"category": ["Activities"], "persona": ["Parent"], "age": ["3-5"], "format": ["Any"], '
+               '"keywords": ["water painting"], "domain": ["Aesthetic and Cultural Development"], '
+               '"curricularGoal": ["CG-12"]}')
+BAD_ANSWER = '"answer": {"category": ["Painting"], "persona": ["Parent", "Any"], "keywords": ["water painting"]}'
+
+
+def run(extract_answer, questions):
+    latencies = []
+    for question in questions:
+        start_time = time.perf_counter()
+        extract_answer(question)
+        latencies.append(time.perf_counter() - start_time)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=40)
+    parser.add_argument("--bad-ratio", type=float, default=0.25, help="share of fast model answers failing validation")
+    parser.add_argument("--fast-latency", type=float, default=0.2)
+    parser.add_argument("--large-latency", type=float, default=1.0)
+    args = parser.parse_args()
+
+    bad_every = round(1 / args.bad_ratio) if args.bad_ratio else 0
+    fast_responses = [BAD_ANSWER if bad_every and index % bad_every == 0 else GOOD_ANSWER
+                      for index in range(1, args.questions + 1)]
+    script = {"chat": {
+        "stub-fast": {"latency": args.fast_latency, "responses": fast_responses},
+        "stub-large": {"latency": args.large_latency, "responses": [GOOD_ANSWER]}
+    }}
+    server, _, url = start_stub(script)
+    os.environ.update({"OPENAI_API_BASE": url, "OPENAI_API_KEY": "stub", "OPENAI_API_VERSION": "2024-02-01",
+                       "fast_gpt_model": "stub-fast", "gpt_model": "stub-large"})
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    import few_shot_util
+
+    questions = [f"How to teach water painting to my child, question {index}?" for index in range(args.questions)]
+    cascade = run(few_shot_util.extract_answer, questions)
+    cascade_metrics = few_shot_util.get_llm_metrics()
+
+    few_shot_util.llm_tiers = ["stub-large"]
+    large_only = run(few_shot_util.extract_answer, questions)
+    server.shutdown()
+
+    print(f"{'mode':<14}{'mean':>9}{'p50':>9}{'max':>9}")
+    for label, latencies in (("cascade", cascade), ("large only", large_only)):
+        print(f"{label:<14}{statistics.mean(latencies):>8.3f}s{statistics.median(latencies):>8.3f}s"
+              f"{max(latencies):>8.3f}s")
+    print("cascade tiers:")
+    for model, metrics in cascade_metrics.items():
+        print(f"  {model}: {metrics}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Logging benchmark: cost of the log calls made while serving one audio request, on the request thread and in
+total, with the former synchronous handler and with the queue-based pipeline of logger.py.
+
+    python benchmarks/bench_logging.py --requests 200 --audio-seconds 30
+"""
+import argparse
+import base64
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "INFO")
+
+from logger import create_queue_logging, date_format, log_format  # noqa: E402
+
+
+def log_audio_request(bench_logger, audio, payload, event):
+    # The log calls made for an audio /v1/context request by main.py, the telemetry middleware and translator.py
+    bench_logger.info({"text": None, "audio": audio, "source_language": "hi"})
+    bench_logger.info({"text": None, "audio": audio, "source_language": "hi"})
+    bench_logger.info({"source_language:", "hi"})
+    bench_logger.info({"label": "telemetry_event", "event": {"body": payload}})
+    bench_logger.info({"src_lang_text:", "मेरे बच्चे को पानी से चित्रकारी कैसे सिखाएं", "eng_text:",
+                       "How to teach my child water painting"})
+    bench_logger.info({"query": "How to teach my child water painting"})
+    bench_logger.info({"label": "api_call", "event": event})
+
+
+def run(handler, requests_count, audio, payload, event, drain=None):
+    bench_logger = logging.getLogger(f"bench_{id(handler)}")
+    bench_logger.propagate = False
+    bench_logger.setLevel(logging.INFO)
+    bench_logger.addHandler(handler)
+    start_time = time.perf_counter()
+    start_cpu = time.process_time()
+    for _ in range(requests_count):
+        log_audio_request(bench_logger, audio, payload, event)
+    request_path = time.perf_counter() - start_time
+    if drain:
+        drain()
+    total_cpu = time.process_time() - start_cpu
+    bench_logger.removeHandler(handler)
+    return request_path / requests_count, total_cpu / requests_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--audio-seconds", type=int, default=30)
+    args = parser.parse_args()
+
+    # 16 kHz, 16 bit mono PCM, base64 encoded
+    audio = base64.b64encode(os.urandom(args.audio_seconds * 32000)).decode("ascii")
+    payload = {"pipelineTasks": [{"taskType": "asr"}], "inputData": {"audio": [{"audioContent": audio}]}}
+    event = {"status_code": 200, "duration": 1200, "body": {"audio": audio, "language": "hi"}, "method": "POST"}
+
+    with open(os.devnull, "w") as devnull:
+        baseline_handler = logging.StreamHandler(devnull)
+        baseline_handler.setFormatter(logging.Formatter(log_format, datefmt=date_format))
+        baseline = run(baseline_handler, args.requests, audio, payload, event)
+
+        queue_handler, listener = create_queue_logging(stream=devnull)
+        # Sampling would drop most of the identical records of this loop, measure the full cost instead
+        queue_handler.filters.clear()
+        listener.start()
+        pipeline = run(queue_handler, args.requests, audio, payload, event, drain=listener.stop)
+
+    print(f"audio input: {len(audio) / 1024:.0f} KiB base64, {args.requests} requests")
+    print(f"{'handler':<22}{'request thread/req':>20}{'total CPU/req':>16}")
+    for label, (request_path, total_cpu) in (("synchronous (before)", baseline), ("queue + redaction", pipeline)):
+        print(f"{label:<22}{request_path * 1000:>17.3f} ms{total_cpu * 1000:>13.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Native-language context benchmark: per-language accuracy and latency of /v1/context when the LLM is given the query
+in its own language, with the translation to English run alongside, against translating the query first and giving
+the LLM the English text. Accuracy is the share of queries whose category and domain match the expected ones.
+
+Runs against the local stub upstreams by default, whose scripted answers only check that both modes are wired up,
+so that the comparison measures the latency. With --live it runs against the upstreams configured in the
+environment, which measures the accuracy of the native-language prompt.
+
+    python benchmarks/bench_native_context.py --runs 3 --llm-latency 1.0 --translation-latency 0.4
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_upstreams import start_stub  # noqa: E402
+
+TOPICS = {
+    "painting": {
+        "english": "How do I teach my child painting with water colours?",
+        "answer": '"answer": {"category": ["Activities"], "persona": ["Parent"], "age": ["3-5"], "format": ["Any"], '
+                  '"keywords": ["water painting"], "domain": ["Aesthetic and Cultural Development"], '
+                  '"curricularGoal": ["Any"]}',
+        "expected": {"category": ["Activities"], "domain": ["Aesthetic and Cultural Development"]}
+    },
+    "counting": {
+        "english": "Suggest a game to teach counting to a three year old child",
+        "answer": '"answer": {"category": ["Activities"], "persona": ["Any"], "age": ["3-5"], "format": ["Any"], '
+                  '"keywords": ["counting game"], "domain": ["Cognitive Development"], "curricularGoal": ["Any"]}',
+        "expected": {"category": ["Activities"], "domain": ["Cognitive Development"]}
+    },
+    "song": {
+        "english": "Play a song about rain for children",
+        "answer": '"answer": {"category": ["Songs"], "persona": ["Any"], "age": ["Any"], "format": ["audio"], '
+                  '"keywords": ["rain song"], "domain": ["Aesthetic and Cultural Development"], '
+                  '"curricularGoal": ["Any"]}',
+        "expected": {"category": ["Songs"], "domain": ["Aesthetic and Cultural Development"]}
+    }
+}
+QUERIES = {
+    "hi": {"painting": "मेरे बच्चे को पानी के रंगों से चित्रकारी कैसे सिखाऊं?",
+           "counting": "तीन साल के बच्चे को गिनती सिखाने का कोई खेल बताइए",
+           "song": "बच्चों के लिए बारिश पर एक गाना सुनाइए"},
+    "bn": {"painting": "আমার সন্তানকে জলরং দিয়ে ছবি আঁকা কীভাবে শেখাব?",
+           "counting": "তিন বছরের শিশুকে গুনতে শেখানোর একটি খেলা বলুন",
+           "song": "বাচ্চাদের জন্য বৃষ্টি নিয়ে একটি গান শোনান"},
+    "ta": {"painting": "என் குழந்தைக்கு நீர் வண்ணங்களால் ஓவியம் வரைய எப்படி கற்றுக்கொடுப்பது?",
+           "counting": "மூன்று வயது குழந்தைக்கு எண்ண கற்றுக்கொடுக்க ஒரு விளையாட்டு சொல்லுங்கள்",
+           "song": "குழந்தைகளுக்கு மழை பற்றிய ஒரு பாடல் பாடுங்கள்"}
+}
+
+
+def is_accurate(context, expected):
+    return context is not None and all(sorted(context.get(key) or []) == sorted(values)
+                                       for key, values in expected.items())
+
+
+def run(client, runs):
+    results = {}
+    for language, queries in QUERIES.items():
+        latencies, accurate = [], 0
+        for _ in range(runs):
+            for topic, text in queries.items():
+                start_time = time.perf_counter()
+                response = client.post("/v1/context", json={"text": text, "language": language})
+                latencies.append(time.perf_counter() - start_time)
+                response.raise_for_status()
+                accurate += is_accurate(response.json()["context"], TOPICS[topic]["expected"])
+        results[language] = (accurate / len(latencies), statistics.mean(latencies))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--translation-latency", type=float, default=0.4)
+    parser.add_argument("--live", action="store_true", help="use the upstreams configured in the environment")
+    args = parser.parse_args()
+
+    server = None
+    if not args.live:
+        answers = {}
+        translations = {}
+        for language, queries in QUERIES.items():
+            for topic, text in queries.items():
+                translations[text] = TOPICS[topic]["english"]
+                answers[text] = TOPICS[topic]["answer"]
+        for topic in TOPICS.values():
+            answers[topic["english"]] = topic["answer"]
+        script = {"chat": {"stub-gpt": {"latency": args.llm_latency, "responses": [answers]}},
+                  "bhashini": {"latency": {"translation": args.translation_latency}, "translations": translations}}
+        server, _, url = start_stub(script)
+        os.environ.update({"OPENAI_API_BASE": url, "OPENAI_API_KEY": "stub", "OPENAI_API_VERSION": "2024-02-01",
+                           "gpt_model": "stub-gpt", "BHASHINI_ENDPOINT_URL": f"{url}/services/inference/pipeline",
+                           "BHASHINI_API_KEY": "stub", "telemetry_log_enabled": "false"})
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    import main as service
+    from fastapi.testclient import TestClient
+
+    with TestClient(service.app) as client:
+        service.native_context_languages = set()
+        translate_first = run(client, args.runs)
+        service.native_context_languages = set(QUERIES)
+        native = run(client, args.runs)
+    if server is not None:
+        server.shutdown()
+
+    print(f"{len(TOPICS)} queries per language, {args.runs} runs, {'live' if args.live else 'stub'} upstreams")
+    print(f"{'language':<10}{'translate first':>28}{'native':>28}")
+    print(f"{'':<10}{'accuracy':>14}{'mean':>14}{'accuracy':>14}{'mean':>14}")
+    for language in QUERIES:
+        (accuracy, latency), (native_accuracy, native_latency) = translate_first[language], native[language]
+        print(f"{language:<10}{accuracy:>14.0%}{latency:>13.3f}s{native_accuracy:>14.0%}{native_latency:>13.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Startup benchmark: import time of the application module, time until a fresh worker answers /health and /ready,
+and latency of its first /v1/context request, sent as soon as the worker is ready, with the warm-up enabled and
+disabled. The worker runs against the local stub upstreams, so that the first request measures the initialization
+of the prompt, the clients and their connections rather than the upstream latency.
+
+Run from the repository root with the service environment variables (.env) available:
+
+    python benchmarks/bench_startup.py --runs 5 --llm-latency 0.2
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_upstreams import start_stub  # noqa: E402
+
+ANSWER = ('"answer": {"category": ["Activities"], "persona": ["Parent"], "age": ["3-5"], "format": ["Any"], '
+          '"keywords": ["water painting"], "domain": ["Aesthetic and Cultural Development"], '
+          '"curricularGoal": ["Any"]}')
+QUERY = {"text": "How do I teach my child painting with water colours?", "language": "en"}
+
+
+def measure_import_time(runs):
+    timings = []
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True,
+                                check=True).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return timings
+
+
+def wait_for(url, deadline):
+    while time.perf_counter() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return time.perf_counter()
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.02)
+    raise TimeoutError(url)
+
+
+def timed_request(url):
+    start_time = time.perf_counter()
+    requests.post(url, json=QUERY, timeout=60).raise_for_status()
+    return time.perf_counter() - start_time
+
+
+def measure_worker(port, timeout, env):
+    """
+    Starts a worker and sends it two /v1/context requests once it is ready.
+
+    Returns:
+        The time until /health and /ready answer, and the latency of the first and the second request.
+    """
+    start_time = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)], cwd=REPO_ROOT,
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = start_time + timeout
+        health_time = wait_for(f"http://127.0.0.1:{port}/health", deadline)
+        ready_time = wait_for(f"http://127.0.0.1:{port}/ready", deadline)
+        first_request = timed_request(f"http://127.0.0.1:{port}/v1/context")
+        second_request = timed_request(f"http://127.0.0.1:{port}/v1/context")
+        return health_time - start_time, ready_time - start_time, first_request, second_request
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def summary(values):
+    return f"median {statistics.median(values):.3f}s, min {min(values):.3f}s, max {max(values):.3f}s"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    import_times = measure_import_time(args.runs)
+    print(f"import main: {summary(import_times)} over {args.runs} runs")
+
+    stub, _, url = start_stub({"chat": {"stub-gpt": {"latency": args.llm_latency, "responses": [ANSWER]}}})
+    env = dict(os.environ, OPENAI_API_BASE=url, OPENAI_API_KEY="stub", OPENAI_API_VERSION="2024-02-01",
+               gpt_model="stub-gpt", fast_gpt_model="", BHASHINI_ENDPOINT_URL=f"{url}/services/inference/pipeline",
+               BHASHINI_API_KEY="stub", telemetry_log_enabled="false", LOG_LEVEL="WARNING")
+    try:
+        for label, warmup_enabled in (("with warm-up", "true"), ("without warm-up", "false")):
+            timings = [measure_worker(args.port, args.timeout, dict(env, warmup_enabled=warmup_enabled))
+                       for _ in range(args.runs)]
+            print(f"{label}, {args.runs} runs")
+            for name, index in (("first /health", 0), ("/ready", 1), ("first /v1/context", 2),
+                                ("second /v1/context", 3)):
+                print(f"  {name:<20}{summary([timing[index] for timing in timings])}")
+    finally:
+        stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
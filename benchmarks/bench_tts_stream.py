@@ -0,0 +1,96 @@
+"""
+Streaming TTS benchmark: time to first audio of a text to audio /v1/translation request with output.stream, against
+the time the non-streaming path takes to synthesize the whole text before it can upload and return it. Runs against
+the local stub upstreams, with a TTS latency growing with the length of the text. Needs ffmpeg for the MP3 encoding.
+
+    python benchmarks/bench_tts_stream.py --sentences 6 --runs 3
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_upstreams import start_stub  # noqa: E402
+
+SENTENCE = "Children learn colours best by mixing paints with water and naming every new shade they see."
+
+
+def wait_for(url, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.1)
+    raise TimeoutError(url)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sentences", type=int, default=6)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--tts-latency", type=float, default=0.3, help="fixed latency of a TTS call in seconds")
+    parser.add_argument("--tts-latency-per-char", type=float, default=0.005)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    script = {"bhashini": {"latency": {"tts": args.tts_latency},
+                           "latency_per_char": {"tts": args.tts_latency_per_char}}}
+    server, _, url = start_stub(script)
+    os.environ.update({"BHASHINI_ENDPOINT_URL": f"{url}/services/inference/pipeline", "BHASHINI_API_KEY": "stub",
+                       "publish_audio": "false", "telemetry_log_enabled": "false"})
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    from io_processing import convert_text_to_audio
+
+    text = " ".join([SENTENCE] * args.sentences)
+    whole = []
+    for _ in range(args.runs):
+        start_time = time.perf_counter()
+        output_file, _ = convert_text_to_audio(text, "en")
+        whole.append(time.perf_counter() - start_time)
+        output_file.close()
+        os.remove(output_file.name)
+
+    service = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port)],
+                               cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    request = {"input": {"text": text, "language": "en"},
+               "output": {"language": "en", "format": "audio", "stream": True}}
+    first_audio, stream_total = [], []
+    try:
+        wait_for(f"http://127.0.0.1:{args.port}/ready", 60)
+        for _ in range(args.runs):
+            start_time = time.perf_counter()
+            with requests.post(f"http://127.0.0.1:{args.port}/v1/translation", json=request, stream=True,
+                               timeout=60) as response:
+                response.raise_for_status()
+                chunks = response.iter_content(chunk_size=None)
+                next(chunks)
+                first_audio.append(time.perf_counter() - start_time)
+                for _ in chunks:
+                    pass
+            stream_total.append(time.perf_counter() - start_time)
+    finally:
+        service.terminate()
+        service.wait()
+        server.shutdown()
+
+    print(f"{args.sentences} sentences, {len(text)} characters, {args.runs} runs")
+    print(f"{'mode':<36}{'mean':>9}")
+    for label, timings in (("whole text synthesized (before)", whole), ("streamed: time to first audio", first_audio),
+                           ("streamed: complete audio", stream_total)):
+        print(f"{label:<36}{statistics.mean(timings):>8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Local stub of the upstream services, serving scripted responses with configurable latency:
+
+* Azure OpenAI chat completions, streamed and non-streamed:
+  POST /openai/deployments/<model>/chat/completions
+* Bhashini inference pipeline with asr, translation and tts tasks:
+  POST /services/inference/pipeline
+
+The script is a JSON file:
+
+    {
+        "chat": {"<model>": {"latency": 0.2, "latency_per_answer": 0.1, "responses": ["<completion>", ...]}},
+        "bhashini": {
+            "latency": {"asr": 0.3, "translation": 0.1, "tts": 0.4},
+            "latency_per_char": {"tts": 0.002},
+            "transcripts": {"<language>": "<text>"},
+            "translations": {"<source text>": "<translated text>"}
+        }
+    }
+
+Latencies per character are added for the length of the task's input text. Chat responses are returned in turn
+per model. A response may also be a dict mapping a substring of the user message to the completion, to script
+answers per question. A user message with numbered questions asking for "answer_N" objects, as sent by
+/v1/context/batch, is answered with one scripted answer per question, taking latency_per_answer more per question.
+Point the service at the stub with
+
+    OPENAI_API_BASE=http://127.0.0.1:<port> BHASHINI_ENDPOINT_URL=http://127.0.0.1:<port>/services/inference/pipeline
+
+    python benchmarks/stub_upstreams.py --port 8900 --script script.json
+"""
+import argparse
+import base64
+import io
+import itertools
+import json
+import re
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+numbered_question_pattern = re.compile(r"^(\d+)\. (.*)$", re.MULTILINE)
+
+
+def silent_wav(seconds=0.5, rate=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        wav_file.writeframes(b"\x00\x00" * int(seconds * rate))
+    return buffer.getvalue()
+
+
+class StubState:
+    def __init__(self, script):
+        self.script = script
+        self.lock = threading.Lock()
+        self.cursors = {}
+        self.requests = []
+        self.tts_audio = base64.b64encode(silent_wav()).decode("ascii")
+
+    def next_completion(self, model, question):
+        model_script = self.script.get("chat", {}).get(model) or {"responses": ['"answer": {}']}
+        with self.lock:
+            cursor = self.cursors.setdefault(model, itertools.cycle(model_script["responses"]))
+            response = next(cursor)
+        if isinstance(response, dict):
+            for key, completion in response.items():
+                if key in question:
+                    return completion
+            return response.get("*", '"answer": {}')
+        return response
+
+    def next_batch_completion(self, model, questions):
+        answers = []
+        for number, question in questions:
+            completion = self.next_completion(model, question)
+            answers.append(f'"answer_{number}": {completion.split(":", 1)[-1].strip()}')
+        return ",\n".join(answers)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: StubState = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with self.state.lock:
+            self.state.requests.append({"path": self.path, "body": body})
+        if "/chat/completions" in self.path:
+            self.chat_completion(self.path.split("/deployments/")[1].split("/")[0], body)
+        elif self.path.startswith("/services/inference/pipeline"):
+            self.pipeline(body)
+        else:
+            self.send_json(404, {"detail": "Not found"})
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def chat_completion(self, model, body):
+        model_script = self.state.script.get("chat", {}).get(model, {})
+        question = body["messages"][-1]["content"]
+        latency = model_script.get("latency", 0.0)
+        questions = numbered_question_pattern.findall(question) if '"answer_N"' in question else []
+        if questions:
+            completion = self.state.next_batch_completion(model, questions)
+            latency += model_script.get("latency_per_answer", 0.0) * len(questions)
+        else:
+            completion = self.state.next_completion(model, question)
+        if not body.get("stream"):
+            time.sleep(latency)
+            self.send_json(200, {
+                "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": completion}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+            })
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        # Spread the latency over the chunks, like a model generating tokens
+        chunks = [completion[index:index + 8] for index in range(0, len(completion), 8)] or [""]
+        try:
+            for chunk in chunks:
+                time.sleep(latency / len(chunks))
+                self.write_event({"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                                  "model": model, "choices": [{"index": 0, "delta": {"content": chunk},
+                                                               "finish_reason": None}]})
+            self.write_chunk(b"data: [DONE]\n\n")
+            self.write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def write_event(self, payload):
+        self.write_chunk(("data: " + json.dumps(payload) + "\n\n").encode("utf-8"))
+
+    def write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def pipeline(self, body):
+        bhashini_script = self.state.script.get("bhashini", {})
+        latencies = bhashini_script.get("latency", {})
+        latencies_per_char = bhashini_script.get("latency_per_char", {})
+        texts = [item.get("source") for item in body.get("inputData", {}).get("input", [])]
+        responses = []
+        for task in body.get("pipelineTasks", []):
+            task_type = task["taskType"]
+            language = task["config"]["language"]
+            # Translation requests may carry the translation serviceId under the "tts" task type
+            if task_type == "tts" and "targetLanguage" in language:
+                task_type = "translation"
+            time.sleep(latencies.get(task_type, 0.0)
+                       + latencies_per_char.get(task_type, 0.0) * sum(len(text or "") for text in texts))
+            if task_type == "asr":
+                texts = [bhashini_script.get("transcripts", {}).get(language["sourceLanguage"], "stub transcript")]
+                responses.append({"taskType": "asr", "output": [{"source": text} for text in texts]})
+            elif task_type == "translation":
+                translations = bhashini_script.get("translations", {})
+                output = [{"source": text, "target": translations.get(text, text)} for text in texts]
+                texts = [item["target"] for item in output]
+                responses.append({"taskType": "translation", "output": output})
+            elif task_type == "tts":
+                responses.append({"taskType": "tts", "audio": [{"audioContent": self.state.tts_audio}
+                                                               for _ in texts]})
+        self.send_json(200, {"pipelineResponse": responses})
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients close streamed completions early on purpose
+        pass
+
+
+def start_stub(script, port=0):
+    """
+    Starts the stub server in a background thread.
+
+    Returns:
+        The server, its state and its base URL.
+    """
+    handler = type("ScriptedStubHandler", (StubHandler,), {"state": StubState(script)})
+    server = StubServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, handler.state, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--script", help="JSON file with the scripted responses")
+    args = parser.parse_args()
+    script = {}
+    if args.script:
+        with open(args.script) as script_file:
+            script = json.load(script_file)
+    server, _, url = start_stub(script, args.port)
+    print(f"Stub upstreams listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
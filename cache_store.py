@@ -0,0 +1,191 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import orjson
+
+from logger import logger
+
+
+class LruCache:
+    """
+    In-memory cache of one worker, evicting the least recently used entries beyond max_entries.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SqliteStore:
+    """
+    Key-value store with expiry in a SQLite file, shared by the workers of a host. Values are JSON serializable.
+    """
+    prune_interval = 100
+
+    def __init__(self, path, table, max_entries):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {self.table} "
+                               f"(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)")
+            connection.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_expires_at ON {self.table} (expires_at)")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        """
+        Returns:
+            The value and its expiry time, or None if the key is missing or expired.
+        """
+        row = self._connection().execute(f"SELECT value, expires_at FROM {self.table} "
+                                         f"WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        if row is None:
+            return None
+        return orjson.loads(row[0]), row[1]
+
+    def set(self, key, value, expires_at):
+        self._connection().execute(f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                                   (key, orjson.dumps(value), expires_at))
+        self._count_write()
+
+    def add(self, key, value, expires_at):
+        """
+        Stores the value only if the key is missing or expired, atomically across the workers.
+
+        Returns:
+            True if the value was stored.
+        """
+        connection = self._connection()
+        connection.execute(f"DELETE FROM {self.table} WHERE key = ? AND expires_at <= ?", (key, time.time()))
+        cursor = connection.execute(f"INSERT OR IGNORE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                                    (key, orjson.dumps(value), expires_at))
+        self._count_write()
+        return cursor.rowcount == 1
+
+    def delete(self, key, value=None):
+        """
+        Deletes the key, or, if a value is given, only if the key still holds that value.
+        """
+        if value is None:
+            self._connection().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+        else:
+            self._connection().execute(f"DELETE FROM {self.table} WHERE key = ? AND value = ?",
+                                       (key, orjson.dumps(value)))
+
+    def _count_write(self):
+        self._writes += 1
+        if self._writes % self.prune_interval == 0:
+            self.prune()
+
+    def prune(self):
+        """
+        Removes the expired entries and the entries closest to expiry beyond max_entries.
+        """
+        connection = self._connection()
+        connection.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (time.time(),))
+        connection.execute(f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} "
+                           f"ORDER BY expires_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+
+class TieredCache:
+    """
+    Cache with a per-worker in-memory LRU tier in front of a SQLite tier shared by the workers of a host. Failures
+    of the shared tier are logged and treated as misses, so that the cache never fails a request.
+    """
+
+    def __init__(self, name, ttl_seconds, max_entries, directory=None, max_disk_entries=0):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.memory = LruCache(max_entries)
+        self.disk = SqliteStore(os.path.join(directory, "cache.sqlite3"), name, max_disk_entries) \
+            if directory else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value, tier = self._lookup(key)
+        if tier == "memory":
+            self.hits += 1
+        elif tier == "disk":
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+        return value
+
+    def peek(self, key):
+        """
+        Same as get, without counting the lookup in the hit rate.
+        """
+        return self._lookup(key)[0]
+
+    def _lookup(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            return value, "memory"
+        if self.disk is not None:
+            try:
+                entry = self.disk.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"Reading {self.name} cache from disk failed: {e}")
+                entry = None
+            if entry is not None:
+                value, expires_at = entry
+                self.memory.set(key, value, expires_at)
+                return value, "disk"
+        return None, None
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl_seconds
+        self.memory.set(key, value, expires_at)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value, expires_at)
+            except sqlite3.Error as e:
+                logger.warning(f"Writing {self.name} cache to disk failed: {e}")
+
+    def metrics(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else None
+        }
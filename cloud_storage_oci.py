@@ -1,22 +1,60 @@
-import boto3
-from botocore.exceptions import ClientError
 import os
+import threading
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from config_util import get_config_value
+from deadline import check_deadline, stage_timeout
 from logger import logger
+from server_timing import span
 from dotenv import load_dotenv
 
 load_dotenv()
-# Create S3 client for OCI object storage
-s3_client = boto3.client(
-    's3',
-    region_name=os.environ["OCI_REGION_NAME"],
-    aws_secret_access_key=os.environ["OCI_SECRET_ACCESS_KEY"],
-    aws_access_key_id=os.environ["OCI_ACCESS_KEY_ID"],
-    endpoint_url=os.environ["OCI_ENDPOINT_URL"]
-)
 
 # OCI Bucket Name
 bucket_name = os.environ["OCI_BUCKET_NAME"]
 
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    """
+    Creates the S3 client for OCI object storage on first use, so that importing this module stays cheap.
+    The client is shared by all threads. It is created once, under a lock and from its own session, since the
+    default boto3 session is not thread-safe.
+    """
+    global _s3_client
+    with _s3_client_lock:
+        if _s3_client is None:
+            import boto3
+            from botocore.config import Config
+
+            _s3_client = boto3.session.Session().client(
+                's3',
+                region_name=os.environ["OCI_REGION_NAME"],
+                aws_secret_access_key=os.environ["OCI_SECRET_ACCESS_KEY"],
+                aws_access_key_id=os.environ["OCI_ACCESS_KEY_ID"],
+                endpoint_url=os.environ["OCI_ENDPOINT_URL"],
+                config=Config(
+                    connect_timeout=float(get_config_value('deadline', 'oci_connect_timeout', None)),
+                    read_timeout=float(get_config_value('deadline', 'oci_read_timeout', None)),
+                    retries={"total_max_attempts": 3}
+                )
+            )
+            # Checked before each retry, so that a failing call is not retried past its request's deadline
+            _s3_client.meta.events.register_first("needs-retry.s3", check_retry_deadline)
+        return _s3_client
+
+
+def check_retry_deadline(**kwargs):
+    check_deadline("upload", "upload timed out")
+
+
+def check_upload_deadline(bytes_sent):
+    # Called for every chunk of the file sent, retries included, so that an upload stops with its request
+    check_deadline("upload", "upload timed out")
+
 
 def upload_file_object(file_name, object_name=None):
     """Upload a file to an OCI bucket
@@ -24,16 +62,28 @@ def upload_file_object(file_name, object_name=None):
     :param file_name: File to upload
     :param object_name: S3 object name. If not specified then file_name is used
     :return: True if file was uploaded, else False
+    :raises DeadlineExceeded: If the request's deadline is exceeded before or during the upload
     """
 
     # If S3 object_name was not specified, use file_name
     if object_name is None:
         object_name = os.path.basename(file_name)
 
+    from boto3.exceptions import S3UploadFailedError
+    from boto3.s3.transfer import TransferConfig
+
+    # Skip the upload when the request's remaining budget cannot cover it
+    stage_timeout("upload")
     try:
-        s3_client.upload_file(file_name, bucket_name, object_name, ExtraArgs={'ACL': 'public-read', "ContentType": "audio/mpeg"})
+        with span("upload"):
+            get_s3_client().upload_file(file_name, bucket_name, object_name, ExtraArgs={'ACL': 'public-read', "ContentType": "audio/mpeg"},
+                                        Callback=check_upload_deadline,
+                                        # In the calling thread, which carries the deadline checked while sending
+                                        Config=TransferConfig(use_threads=False))
         logger.info(f"File uploaded to OCI Object Storage bucket: {bucket_name}")
-    except ClientError as e:
+    except (ClientError, S3UploadFailedError, BotoCoreError) as e:
+        # Timeouts and uploads aborted at the request's deadline are reported as exceeding it
+        check_deadline("upload", "upload timed out")
         logger.error(f"Exception uploading a file: {e}", exc_info=True)
         return False
     return True
@@ -52,7 +102,7 @@ def download_file_object(file_name, object_name=None):
         object_name = os.path.basename(file_name)
 
     try:
-        s3_client.download_file(bucket_name, object_name, file_name)
+        get_s3_client().download_file(bucket_name, object_name, file_name)
         logger.info(f"File downloaded from OCI Object Storage bucket: {bucket_name}")
     except ClientError as e:
         logger.error(f"Exception downloading a file: {e}", exc_info=True)
@@ -70,10 +120,10 @@ def create_presigned_url(object_name, expiration=3600):
 
     # Generate a presigned URL for the S3 object
     try:
-        response = s3_client.generate_presigned_url('get_object',
-                                                    Params={'Bucket': bucket_name,
-                                                            'Key': object_name},
-                                                    ExpiresIn=expiration)
+        response = get_s3_client().generate_presigned_url('get_object',
+                                                          Params={'Bucket': bucket_name,
+                                                                  'Key': object_name},
+                                                          ExpiresIn=expiration)
     except ClientError as e:
         logger.error(f"Exception generating public URL: {e}", exc_info=True)
         return None
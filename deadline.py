@@ -0,0 +1,198 @@
+import asyncio
+import contextvars
+import json
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from config_util import get_config_value
+from logger import logger
+from server_timing import run_traced
+
+deadline_header = get_config_value('deadline', 'deadline_header', None).lower()
+max_timeout = float(get_config_value('deadline', 'max_timeout', None))
+upstream_timeout = float(get_config_value('deadline', 'upstream_timeout', None))
+endpoint_timeouts = {
+    "/v1/context": float(get_config_value('deadline', 'context_timeout', None)),
+    "/v1/context/batch": float(get_config_value('deadline', 'context_batch_timeout', None)),
+    "/v1/translation": float(get_config_value('deadline', 'translation_timeout', None))
+}
+# Minimum time budget a stage needs to have any chance of finishing, e.g. "asr:2,translation:1"
+stage_min_seconds = {
+    stage.strip(): float(seconds)
+    for stage, seconds in (item.split(":") for item in get_config_value('deadline', 'stage_min_seconds', None).split(","))
+}
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage, reason="deadline exceeded"):
+        super().__init__(f"{stage}: {reason}")
+        self.stage = stage
+        self.reason = reason
+
+
+class Deadline:
+    """
+    Time budget of a single request, shared by every stage of its pipeline.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+        self.cancelled = False
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def cancel(self):
+        self.cancelled = True
+
+    def timeout_for(self, stage):
+        """
+        Returns the timeout a stage should use for its upstream call.
+
+        Raises:
+            DeadlineExceeded: If the request was cancelled or the remaining budget is too small for the stage.
+        """
+        if self.cancelled:
+            raise DeadlineExceeded(stage, "client disconnected")
+        remaining = self.remaining()
+        if remaining <= 0 or remaining < stage_min_seconds.get(stage, 0.0):
+            raise DeadlineExceeded(stage)
+        return remaining
+
+
+_current_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+def current_deadline():
+    return _current_deadline.get()
+
+
+def stage_timeout(stage):
+    """
+    Timeout for an upstream call of the given stage, derived from the current request's remaining budget.
+    Outside of a request (or without a deadline) the default upstream timeout is used.
+    """
+    deadline = current_deadline()
+    if deadline is None:
+        return upstream_timeout
+    return deadline.timeout_for(stage)
+
+
+def check_deadline(stage, reason="deadline exceeded"):
+    """
+    Raises DeadlineExceeded if the current request's deadline expired or the request was cancelled, for stages
+    reading a response in a loop, whose timeout only bounds each read.
+    """
+    deadline = current_deadline()
+    if deadline is None:
+        return
+    if deadline.cancelled:
+        raise DeadlineExceeded(stage, "client disconnected")
+    if deadline.remaining() <= 0:
+        raise DeadlineExceeded(stage, reason)
+
+
+async def run_stage(func, *args, **kwargs):
+    """
+    Runs a blocking pipeline stage in the thread pool, carrying the request's deadline along with it, so that
+    the event loop stays free to enforce the deadline and notice client disconnects.
+    """
+    context = contextvars.copy_context()
+    return await run_in_threadpool(context.run, run_traced, func, *args, **kwargs)
+
+
+def get_request_timeout(path, headers):
+    timeout = endpoint_timeouts.get(path, upstream_timeout)
+    header_value = headers.get(deadline_header)
+    if header_value:
+        try:
+            timeout = float(header_value)
+        except ValueError:
+            logger.warning({"label": "invalid_deadline_header", "value": header_value})
+    return min(max(timeout, 0.0), max_timeout)
+
+
+class DeadlineMiddleware:
+    """
+    ASGI middleware which gives every /v1 request a deadline. The request is aborted with 504 when the deadline
+    expires and its in-flight work is cancelled when the client disconnects.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/v1/"):
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+        deadline = Deadline(get_request_timeout(scope["path"], headers))
+
+        # Buffer the request body so that the remaining receive channel only carries the disconnect
+        messages = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            messages.append(message)
+            more_body = message.get("more_body", False)
+
+        disconnected = asyncio.Event()
+        response_started = False
+
+        async def replay_receive():
+            if messages:
+                return messages.pop(0)
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def watch_disconnect():
+            message = await receive()
+            while message["type"] != "http.disconnect":
+                message = await receive()
+            disconnected.set()
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        token = _current_deadline.set(deadline)
+        app_task = asyncio.ensure_future(self.app(scope, replay_receive, tracking_send))
+        watcher = asyncio.ensure_future(watch_disconnect())
+        _current_deadline.reset(token)
+        try:
+            done, _ = await asyncio.wait({app_task, watcher}, timeout=deadline.remaining(),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if app_task in done:
+                app_task.result()
+                return
+            deadline.cancel()
+            app_task.cancel()
+            try:
+                await app_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            if watcher in done:
+                logger.info({"label": "client_disconnected", "path": scope["path"]})
+                return
+            logger.warning({"label": "deadline_exceeded", "path": scope["path"], "timeout": deadline.timeout})
+            if not response_started:
+                await send_timeout_response(send, "Request deadline exceeded!")
+        finally:
+            watcher.cancel()
+
+
+async def send_timeout_response(send, detail):
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 504,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("latin-1"))]
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -1,25 +1,86 @@
+import functools
+import inspect
 import json
-
-import outlines
 import os
+import re
+import threading
+import time
 
-from openai import AzureOpenAI
-
+from answer_parser import AnswerStreamParser, find_answer_issues, parse_allowed_values, parse_answer, \
+    parse_numbered_answers, validate_answer
 from config_util import get_config_value
+from deadline import DeadlineExceeded, check_deadline, stage_timeout
+from logger import logger
+from server_timing import span
 
-client = AzureOpenAI(
-    azure_endpoint=os.environ["OPENAI_API_BASE"],
-    api_key=os.environ["OPENAI_API_KEY"],
-    api_version=os.environ["OPENAI_API_VERSION"]
-)
 gpt_model = get_config_value("llm", "gpt_model", None)
+# Cheaper, lower latency deployment asked first; answers failing validation are escalated to gpt_model
+fast_gpt_model = get_config_value("llm", "fast_gpt_model", None)
 instructions = get_config_value('few_shot_config', 'instructions', None)
 examples = json.loads(get_config_value('few_shot_config', 'examples', None))
+llm_stream = get_config_value("llm", "stream", None).lower() == "true"
+llm_max_tokens = int(get_config_value("llm", "max_tokens", None))
+allowed_values = parse_allowed_values(instructions)
+llm_tiers = [model for model in (fast_gpt_model, gpt_model) if model]
+
+
+class TierStats:
+    """
+    Hit rate and latency counters of one LLM tier.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.accepted = 0
+        self.escalated = 0
+        self.errors = 0
+        self.total_latency = 0.0
+
+    def metrics(self):
+        return {
+            "calls": self.calls,
+            "accepted": self.accepted,
+            "escalated": self.escalated,
+            "errors": self.errors,
+            "hit_rate": round(self.accepted / self.calls, 3) if self.calls else None,
+            "avg_latency": round(self.total_latency / self.calls, 3) if self.calls else None
+        }
 
 
-@outlines.prompt
-def few_shots(instructions, examples):
-    """{{ instructions }}
+tier_stats = {model: TierStats() for model in llm_tiers}
+tier_stats_lock = threading.Lock()
+
+
+def record_tier_call(model, latency, accepted=False, escalated=False, error=False):
+    with tier_stats_lock:
+        stats = tier_stats.setdefault(model, TierStats())
+        stats.calls += 1
+        stats.total_latency += latency
+        stats.accepted += accepted
+        stats.escalated += escalated
+        stats.errors += error
+
+
+def get_llm_metrics():
+    with tier_stats_lock:
+        return {model: stats.metrics() for model, stats in tier_stats.items()}
+
+
+@functools.lru_cache(maxsize=None)
+def get_client():
+    """
+    Creates the Azure OpenAI client on first use, so that importing this module stays cheap.
+    """
+    from openai import AzureOpenAI
+
+    return AzureOpenAI(
+        azure_endpoint=os.environ["OPENAI_API_BASE"],
+        api_key=os.environ["OPENAI_API_KEY"],
+        api_version=os.environ["OPENAI_API_VERSION"]
+    )
+
+
+few_shots_template = """{{ instructions }}
 
     Examples
     --------
@@ -42,20 +103,191 @@ def few_shots(instructions, examples):
     """
 
 
-prompt = few_shots(instructions, examples)
+def render_prompt(template, **values):
+    """
+    Renders a Jinja2 prompt template the same way outlines prompt functions do: the template is dedented and
+    repeated whitespaces are collapsed before rendering.
+    """
+    from jinja2 import Environment, StrictUndefined
+
+    cleaned_template = inspect.cleandoc(template)
+    if template.replace(" ", "").endswith("\n\n"):
+        cleaned_template += "\n"
+    cleaned_template = re.sub(r"(?![\r\n])(\b\s+)", " ", cleaned_template)
+    env = Environment(trim_blocks=True, lstrip_blocks=True, keep_trailing_newline=True, undefined=StrictUndefined)
+    return env.from_string(cleaned_template).render(**values)
+
 
+@functools.lru_cache(maxsize=None)
+def get_prompt():
+    """
+    Renders the few-shot prompt template on first use.
+    """
+    return render_prompt(few_shots_template, instructions=instructions, examples=examples)
 
-def invokeLLM(question):
-    system_rules = prompt.replace("user_question", question)
-    print("system_rules::: ", system_rules)
 
-    res = client.chat.completions.create(
-        model=gpt_model,
-        temperature=0,
-        messages=[
-            {"role": "system", "content": system_rules},
-            {"role": "user", "content": question}
-        ],
-    )
+language_names = {"bn": "Bengali", "en": "English", "gu": "Gujarati", "hi": "Hindi", "kn": "Kannada",
+                  "ml": "Malayalam", "mr": "Marathi", "or": "Odia", "pa": "Punjabi", "ta": "Tamil", "te": "Telugu"}
+native_language_instructions = ('The question is written in {language}. Understand it in {language} and answer it '
+                                'the same way as an English question: every value of "answer", the keywords '
+                                'included, must be in English and taken from the allowed values.')
+
+
+def get_messages(question, language=None):
+    """
+    Builds the few-shot messages for the question. A question in another language than English is asked as it is,
+    with the instruction to answer it in English added to the user message, so that the system prompt stays the
+    same for every language.
+    """
+    system_rules = get_prompt().replace("user_question", question)
+    logger.debug({"system_rules": system_rules})
+    user_content = question
+    if language is not None and language != "en":
+        user_content = (f"{native_language_instructions.format(language=language_names.get(language, language))}"
+                        f"\n\n{question}")
+    return [
+        {"role": "system", "content": system_rules},
+        {"role": "user", "content": user_content}
+    ]
+
+
+batch_instructions = ('Answer each of the following numbered questions separately, the same way as a single question. '
+                      'For every question N give its final answer in the format "answer_N": {...}, with the same '
+                      'attributes as "answer".')
+
+
+def get_batch_messages(questions):
+    numbered_questions = "\n".join(f"{index}. {question}" for index, question in enumerate(questions, 1))
+    system_rules = get_prompt().replace("user_question", numbered_questions)
+    logger.debug({"system_rules": system_rules})
+    return [
+        {"role": "system", "content": system_rules},
+        {"role": "user", "content": f"{batch_instructions}\n\n{numbered_questions}"}
+    ]
+
+
+def invokeLLM(question, model=gpt_model, language=None):
+    from openai import APITimeoutError
+
+    try:
+        res = get_client().chat.completions.create(
+            model=model,
+            temperature=0,
+            messages=get_messages(question, language),
+            max_tokens=llm_max_tokens,
+            timeout=stage_timeout("llm")
+        )
+    except APITimeoutError as e:
+        raise DeadlineExceeded("llm", "LLM call timed out") from e
 
     return res.choices[0].message.model_dump()
+
+
+def stream_answer(question, model=gpt_model, language=None):
+    """
+    Streams the completion and stops reading it as soon as the "answer" object is closed.
+
+    Returns:
+        The answer dict, or None if the completion did not contain a parsable answer.
+    """
+    from openai import APITimeoutError
+
+    parser = AnswerStreamParser()
+    try:
+        stream = get_client().chat.completions.create(
+            model=model,
+            temperature=0,
+            messages=get_messages(question, language),
+            max_tokens=llm_max_tokens,
+            stream=True,
+            timeout=stage_timeout("llm")
+        )
+        try:
+            for chunk in stream:
+                check_deadline("llm", "LLM call timed out")
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                if parser.feed(chunk.choices[0].delta.content) is not None:
+                    break
+        finally:
+            stream.close()
+    except APITimeoutError as e:
+        raise DeadlineExceeded("llm", "LLM call timed out") from e
+    if parser.answer is None:
+        logger.warning({"label": "llm_answer_missing", "content": parser.buffer})
+    return parser.answer
+
+
+def request_answer(question, model, language=None):
+    with span("llm"):
+        if llm_stream:
+            return stream_answer(question, model, language)
+        return parse_answer(invokeLLM(question, model, language)["content"])
+
+
+def extract_answer(question, language=None):
+    """
+    Asks the LLM tiers for the context attributes of the question, cheapest tier first. An answer is accepted when
+    it passes validation, otherwise the question is escalated to the next tier. The question is in English, unless
+    its language is given.
+
+    Returns:
+        The answer dict validated against the allowed attribute values, or None if the LLM gave no valid answer.
+    """
+    answer = None
+    for tier, model in enumerate(llm_tiers):
+        is_last_tier = tier == len(llm_tiers) - 1
+        start_time = time.time()
+        try:
+            answer = request_answer(question, model, language)
+            issues = find_answer_issues(answer, allowed_values)
+        except Exception as e:
+            if is_last_tier or isinstance(e, DeadlineExceeded):
+                record_tier_call(model, time.time() - start_time, error=True)
+                raise
+            logger.error(f"LLM tier {model} failed: {e}", exc_info=True)
+            answer = None
+            issues = ["error"]
+        record_tier_call(model, time.time() - start_time, accepted=not issues,
+                         escalated=bool(issues) and not is_last_tier, error=issues == ["error"])
+        if not issues:
+            break
+        if not is_last_tier:
+            logger.info({"label": "llm_escalated", "model": model, "issues": issues})
+    return validate_answer(answer, allowed_values)
+
+
+def extract_batch_answers(questions, model=gpt_model):
+    """
+    Asks the LLM for the context attributes of several questions in a single completion, so that the few-shot
+    prompt is sent and the round trip is paid once for all of them.
+
+    Returns:
+        For every question, the answer validated against the allowed attribute values, or None if the completion
+        has no parsable answer for it.
+    """
+    from openai import APITimeoutError
+
+    start_time = time.time()
+    try:
+        with span("llm"):
+            res = get_client().chat.completions.create(
+                model=model,
+                temperature=0,
+                messages=get_batch_messages(questions),
+                max_tokens=llm_max_tokens * len(questions),
+                timeout=stage_timeout("llm")
+            )
+    except Exception as e:
+        record_tier_call(model, time.time() - start_time, error=True)
+        if isinstance(e, APITimeoutError):
+            raise DeadlineExceeded("llm", "LLM call timed out") from e
+        raise
+
+    answers = parse_numbered_answers(res.choices[0].message.content)
+    answers = [validate_answer(answers[index], allowed_values) if isinstance(answers.get(index), dict) else None
+               for index in range(1, len(questions) + 1)]
+    # A batched call is accepted when it answered every question, the missing ones are asked again on their own
+    complete = all(answer is not None for answer in answers)
+    record_tier_call(model, time.time() - start_time, accepted=complete, escalated=not complete)
+    return answers
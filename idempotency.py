@@ -0,0 +1,173 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+import uuid
+
+from starlette.concurrency import run_in_threadpool
+
+from cache_store import SqliteStore
+from config_util import get_config_value
+from deadline import current_deadline, max_timeout
+from logger import logger
+
+idempotency_enabled = get_config_value('idempotency', 'enabled', None).lower() == "true"
+idempotency_header = get_config_value('idempotency', 'header', None).lower()
+idempotency_ttl = float(get_config_value('idempotency', 'ttl_seconds', None))
+poll_interval = float(get_config_value('idempotency', 'poll_interval_ms', None)) / 1000
+max_key_length = 255
+# Responses are stored next to the caches, in a table of the SQLite file shared by the workers of a host
+response_store = SqliteStore(os.path.join(get_config_value('cache', 'cache_directory', None), "cache.sqlite3"),
+                             "idempotency", int(get_config_value('idempotency', 'max_entries', None)))
+
+PENDING = "pending"
+COMPLETED = "completed"
+metrics = {"executed": 0, "replayed": 0, "waited": 0, "conflicts": 0, "not_stored": 0, "errors": 0}
+
+
+def get_idempotency_metrics():
+    return dict(metrics)
+
+
+def claim(key, fingerprint, expires_at):
+    """
+    Claims the key for a request, unless another request holds it.
+
+    Returns:
+        The pending record if the key was claimed, otherwise the record of the request holding it, or None if that
+        record expired in the meantime.
+    """
+    pending = {"state": PENDING, "fingerprint": fingerprint, "owner": uuid.uuid4().hex}
+    if response_store.add(key, pending, expires_at):
+        return pending, True
+    entry = response_store.get(key)
+    return (entry[0] if entry is not None else None), False
+
+
+async def send_json(send, status, content):
+    await send_response(send, status, [(b"content-type", b"application/json")], content.encode("utf-8"))
+
+
+async def send_response(send, status, headers, body):
+    headers = [(key, value) for key, value in headers if key != b"content-length"]
+    headers.append((b"content-length", str(len(body)).encode("latin-1")))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+class IdempotencyMiddleware:
+    """
+    ASGI middleware making /v1 requests with an Idempotency-Key header safe to retry. The first request with a key
+    runs and its successful JSON response is stored for the configured TTL, in a store shared by the workers of the
+    host. A duplicate arriving while the first request runs waits for its response, later duplicates get the
+    stored response at once, with an Idempotent-Replayed header. Failed and streamed responses are not stored, so
+    that their retries run again. A key reused with a different request body is rejected with HTTP 422.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not idempotency_enabled or scope["type"] != "http" or scope["method"] != "POST" \
+                or not scope["path"].startswith("/v1/"):
+            await self.app(scope, receive, send)
+            return
+        idempotency_key = dict(scope["headers"]).get(idempotency_header.encode("latin-1"))
+        if idempotency_key is None:
+            await self.app(scope, receive, send)
+            return
+        if not idempotency_key or len(idempotency_key) > max_key_length:
+            await send_json(send, 400, '{"detail":"Invalid Idempotency-Key header!"}')
+            return
+
+        messages = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            messages.append(message)
+            more_body = message.get("more_body", False)
+
+        async def replay_receive():
+            if messages:
+                return messages.pop(0)
+            return await receive()
+
+        key = hashlib.sha256(scope["path"].encode("utf-8") + b"\n" + idempotency_key).hexdigest()
+        fingerprint = hashlib.sha256(b"".join(message.get("body", b"") for message in messages)).hexdigest()
+        # A claim outlives its request only if the worker dies, the request is aborted at its deadline otherwise
+        deadline = current_deadline()
+        claim_expires_at = time.time() + (deadline.remaining() if deadline is not None else max_timeout) + 1
+
+        waited = False
+        while True:
+            try:
+                record, claimed = await run_in_threadpool(claim, key, fingerprint, claim_expires_at)
+            except sqlite3.Error as e:
+                metrics["errors"] += 1
+                logger.warning(f"Idempotency store failed, running the request without it: {e}")
+                await self.app(scope, replay_receive, send)
+                return
+            if claimed:
+                break
+            if record is None:
+                continue
+            if record["fingerprint"] != fingerprint:
+                metrics["conflicts"] += 1
+                await send_json(send, 422, '{"detail":"Idempotency-Key was already used for a different request!"}')
+                return
+            if record["state"] == COMPLETED:
+                metrics["replayed"] += 1
+                logger.info({"label": "idempotent_replay", "path": scope["path"], "waited": waited})
+                headers = [[name.encode("latin-1"), value.encode("latin-1")] for name, value in record["headers"]]
+                await send_response(send, record["status"], [*headers, [b"idempotent-replayed", b"true"]],
+                                    record["body"].encode("utf-8"))
+                return
+            if not waited:
+                metrics["waited"] += 1
+                waited = True
+            await asyncio.sleep(poll_interval)
+
+        await self.run_and_store(scope, replay_receive, send, key, record)
+
+    async def run_and_store(self, scope, receive, send, key, pending):
+        metrics["executed"] += 1
+        response = {"status": None, "headers": [], "body": []}
+
+        async def capturing_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [[name.decode("latin-1"), value.decode("latin-1")]
+                                       for name, value in message.get("headers", [])]
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+            await send(message)
+
+        stored = False
+        try:
+            await self.app(scope, receive, capturing_send)
+            content_type = next((value for name, value in response["headers"] if name.lower() == "content-type"), "")
+            if response["status"] is not None and 200 <= response["status"] < 300 \
+                    and content_type.startswith("application/json"):
+                record = {"state": COMPLETED, "fingerprint": pending["fingerprint"], "status": response["status"],
+                          "headers": response["headers"], "body": b"".join(response["body"]).decode("utf-8")}
+                await run_in_threadpool(response_store.set, key, record, time.time() + idempotency_ttl)
+                stored = True
+            else:
+                metrics["not_stored"] += 1
+        except sqlite3.Error as e:
+            metrics["errors"] += 1
+            logger.warning(f"Storing the idempotent response failed: {e}")
+        finally:
+            if not stored:
+                # Released in the background, the request may have been cancelled
+                asyncio.get_running_loop().run_in_executor(None, self.release, key, pending)
+
+    @staticmethod
+    def release(key, pending):
+        try:
+            response_store.delete(key, pending)
+        except sqlite3.Error as e:
+            logger.warning(f"Releasing the idempotency key failed: {e}")
@@ -1,30 +1,101 @@
+from audio_probe import AudioRejected
+from audio_verifier_util import generate_temp_filename
+from cloud_storage_oci import give_public_url, upload_file_object
+from deadline import DeadlineExceeded
 from logger import logger
+from transcript_cache import cache_transcript, get_cached_transcript
 from translator import *
+import os
 import time
 
 
 def transcribe_audio_to_reg_eng_text(file_url, input_language):
-    error_message = None
+    regional_text, english_text, _, error_message = translate_audio(file_url, input_language, 'en')
+    return regional_text, english_text, error_message
+
+
+def translate_audio(file_url, input_language, output_language, synthesize=False):
+    """
+    Transcribes the audio, translates the transcript and optionally synthesizes the translation with a single fused
+    Bhashini pipeline call. Transcripts and translations of recordings seen before are taken from the transcript
+    cache, so that only the remaining tasks are run. Falls back to separate calls when the fused call fails.
+
+    Returns:
+        The transcript, the translated text, the output audio file (when synthesized) and an error message.
+    """
+    try:
+        encoded_string, wav_file_content = get_encoded_string(file_url)
+    except (DeadlineExceeded, AudioRejected):
+        raise
+    except Exception as e:
+        logger.error(f"Exception occurred: {e}", exc_info=True)
+        return None, None, None, "Speech to text conversion API failed"
+
+    service_id = asr_mapping[input_language]
+    regional_text, translated_text = get_cached_transcript(wav_file_content, input_language, service_id,
+                                                           output_language)
+    tasks = []
+    if regional_text is None:
+        tasks.append("asr")
+    if translated_text is None and input_language != output_language:
+        tasks.append("translation")
+    if synthesize:
+        tasks.append("tts")
+    if not tasks:
+        return regional_text, translated_text, None, None
+
     try:
-        regional_text = audio_input_to_text(file_url, input_language)
+        if tasks[0] == "asr":
+            outputs = run_pipeline(tasks, input_language, output_language, encoded_audio=encoded_string)
+        elif tasks[0] == "translation":
+            outputs = run_pipeline(tasks, input_language, output_language, text=regional_text)
+        else:
+            outputs = run_pipeline(tasks, output_language, text=translated_text)
+        regional_text = outputs.get("asr", regional_text)
+        translated_text = outputs.get("translation", translated_text or regional_text)
+        decoded_audio_content = outputs.get("tts")
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.warning(f"Fused pipeline call {tasks} failed, falling back to separate calls: {e}")
+        return translate_audio_separately(encoded_string, wav_file_content, input_language, output_language,
+                                          synthesize)
+
+    if "asr" in tasks or "translation" in tasks:
+        cache_transcript(wav_file_content, input_language, service_id, regional_text, output_language,
+                         translated_text)
+    if not synthesize:
+        return regional_text, translated_text, None, None
+    output_file, error_message = save_audio_output(decoded_audio_content)
+    return regional_text, translated_text, output_file, error_message
+
+
+def translate_audio_separately(encoded_string, wav_file_content, input_language, output_language, synthesize=False):
+    regional_text, _ = get_cached_transcript(wav_file_content, input_language, asr_mapping[input_language])
+    if regional_text is None:
         try:
-            english_text = indic_translation(text=regional_text, source=input_language, destination='en')
+            regional_text = speech_to_text(encoded_string, input_language)
+        except DeadlineExceeded:
+            raise
         except Exception as e:
-            error_message = "Indic translation to English failed"
             logger.error(f"Exception occurred: {e}", exc_info=True)
-            english_text = None
-    except Exception as e:
-        error_message = "Speech to text conversion API failed"
-        logger.error(f"Exception occurred: {e}", exc_info=True)
-        regional_text = None
-        english_text = None
-    return regional_text, english_text, error_message
+            return None, None, None, "Speech to text conversion API failed"
+
+    translated_text, error_message = translate_text(regional_text, input_language, output_language)
+    cache_transcript(wav_file_content, input_language, asr_mapping[input_language], regional_text, output_language,
+                     translated_text)
+    output_file = None
+    if synthesize and translated_text is not None:
+        output_file, error_message = convert_text_to_audio(translated_text, output_language)
+    return regional_text, translated_text, output_file, error_message
 
 
 def translate_text_to_english(regional_text, input_language):
     error_message = None
     try:
         english_text = indic_translation(text=regional_text, source=input_language, destination='en')
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         error_message = "Indic translation to English failed"
         english_text = None
@@ -36,10 +107,9 @@ def translate_text(input_text, input_language, output_language):
     error_message = None
     try:
         regional_text = indic_translation(text=input_text, source=input_language, destination=output_language)
+    except DeadlineExceeded:
+        raise
     except Exception as ex:
-        print(type(ex))  # the exception type
-        print(ex.args)  # arguments stored in .args
-        print(ex)
         error_message = "Translation to indic language failed"
         logger.error(f"Exception occurred: {ex}", exc_info=True)
         regional_text = None
@@ -47,16 +117,46 @@ def translate_text(input_text, input_language, output_language):
 
 
 def convert_text_to_audio(message, input_language):
-    error_message = None
     decoded_audio_content = text_to_speech(language=input_language, text=message)
-    if decoded_audio_content is not None:
+    return save_audio_output(decoded_audio_content)
+
+
+def generate_output_filename():
+    time_stamp = time.strftime("%Y%m%d-%H%M%S")
+    return generate_temp_filename("mp3", prefix="audio-output-" + time_stamp)
+
+
+def save_audio_output(decoded_audio_content, filename=None):
+    error_message = None
+    if decoded_audio_content:
         logger.info("Creating output MP3 file")
-        time_stamp = time.strftime("%Y%m%d-%H%M%S")
-        filename = "audio-output-" + time_stamp + ".mp3"
+        filename = filename or generate_output_filename()
         output_mp3_file = open(filename, "wb")
         output_mp3_file.write(decoded_audio_content)
+        output_mp3_file.flush()
         logger.info("Audio Response is saved as a MP3 file.")
         return output_mp3_file, error_message
     error_message = "Text to Audio conversion failed"
     logger.error(error_message)
     return None, error_message
+
+
+def publish_audio_file(output_file):
+    """
+    Uploads the output audio file to OCI object storage and removes the local copy.
+
+    Returns:
+        The public URL of the audio and an error message.
+    """
+    try:
+        if not upload_file_object(output_file.name):
+            return None, "Audio upload failed"
+        return give_public_url(output_file.name)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.error(f"Exception uploading the audio: {e}", exc_info=True)
+        return None, "Audio upload failed"
+    finally:
+        output_file.close()
+        os.remove(output_file.name)
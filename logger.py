@@ -1,5 +1,13 @@
+import atexit
+import hashlib
+import json
 import logging
 import os
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
 
 from dotenv import load_dotenv
 
@@ -7,13 +15,153 @@ load_dotenv()
 logger_name = "sakhi_activity"
 
 log_level = os.environ["LOG_LEVEL"]
+# "json" for structured output, "text" for the plain format
+log_output_format = os.getenv("LOG_FORMAT", "json").lower()
+# Strings longer than this inside logged dicts are truncated and hashed
+log_max_field_length = int(os.getenv("LOG_MAX_FIELD_LENGTH", "256"))
+log_max_message_length = int(os.getenv("LOG_MAX_MESSAGE_LENGTH", "4096"))
+# Every call site may log this many INFO records per window, after which only 1 in LOG_INFO_SAMPLE_RATE is kept
+log_info_burst = int(os.getenv("LOG_INFO_BURST", "100"))
+log_info_sample_rate = int(os.getenv("LOG_INFO_SAMPLE_RATE", "10"))
+log_sample_window = float(os.getenv("LOG_SAMPLE_WINDOW_SECONDS", "60"))
+
+# Fields which are never logged verbatim, whatever their size
+redacted_fields = {"audio", "audioContent", "system_rules", "prompt"}
 
 log_format = '%(asctime)s - %(thread)d - %(threadName)s - %(name)s - %(levelname)s - %(message)s'
-logging.basicConfig(
-    level=log_level,
-    format=log_format,
-    datefmt='%Y-%m-%d %H:%M:%S',
-)
+date_format = '%Y-%m-%d %H:%M:%S'
+
+
+def summarize(value: str):
+    digest = hashlib.sha256(value.encode("utf-8", "ignore")).hexdigest()[:16]
+    return f"<{len(value)} chars sha256:{digest}>"
+
+
+def redact(value, key=None, max_length=log_max_field_length):
+    """
+    Returns a copy of a log payload in which large strings are truncated and sensitive fields are hashed.
+    """
+    if isinstance(value, dict):
+        return {k: redact(v, k, max_length) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [redact(item, key, max_length) for item in value]
+    if isinstance(value, str):
+        if key in redacted_fields and value:
+            return summarize(value)
+        if len(value) > max_length:
+            return value[:max_length] + "..." + summarize(value)
+    return value
+
+
+def snapshot(value):
+    """
+    Returns a copy of a log payload taken on the calling thread, so that changes made to it after the logging call
+    do not show in the record formatted later. Values other than containers and primitives are converted to strings,
+    as the JSON output does.
+    """
+    if isinstance(value, dict):
+        return {k: snapshot(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [snapshot(item) for item in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        if isinstance(record.msg, (dict, list)) and not record.args:
+            message = redact(record.msg)
+        else:
+            message = redact(record.getMessage(), max_length=log_max_message_length)
+        entry = {
+            "time": self.formatTime(record, date_format),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": message
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        if isinstance(record.msg, (dict, list)) and not record.args:
+            record.msg = redact(record.msg)
+        else:
+            record.msg = redact(record.getMessage(), max_length=log_max_message_length)
+            record.args = None
+        return super().format(record)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Samples repetitive INFO and DEBUG records per call site. Warnings and errors are always kept.
+    """
+
+    def __init__(self, burst=log_info_burst, sample_rate=log_info_sample_rate, window=log_sample_window):
+        super().__init__()
+        self.burst = burst
+        self.sample_rate = max(1, sample_rate)
+        self.window = window
+        self._counts = {}
+        self._window_start = time.monotonic()
+        # Records are filtered on the logging threads
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        call_site = (record.pathname, record.lineno)
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start > self.window:
+                self._counts = {}
+                self._window_start = now
+            count = self._counts.get(call_site, 0) + 1
+            self._counts[call_site] = count
+        return count <= self.burst or (count - self.burst) % self.sample_rate == 0
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Queue handler which leaves the formatting to the background listener, so that logging a large payload costs
+    the calling thread no more than copying it and a queue put.
+    """
+
+    def prepare(self, record):
+        # The caller may change a logged dict once the call returns, e.g. a request body or telemetry event
+        if isinstance(record.msg, (dict, list)) and not record.args:
+            record.msg = snapshot(record.msg)
+        elif not isinstance(record.msg, str):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def create_queue_logging(stream=None):
+    """
+    Creates the queue handler used by the application loggers and the listener writing its records from a
+    background thread.
+    """
+    stream_handler = logging.StreamHandler(stream or sys.stderr)
+    if log_output_format == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(TextFormatter(log_format, datefmt=date_format))
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=False)
+    return queue_handler, listener
+
+
+queue_handler, log_listener = create_queue_logging()
+logging.basicConfig(level=log_level, handlers=[queue_handler])
+log_listener.start()
+atexit.register(log_listener.stop)
 
 # Configure the logger
 logger = logging.getLogger(logger_name)
@@ -1,12 +1,28 @@
-from fastapi import FastAPI, HTTPException, status
+import asyncio
+from typing import List
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, Request, status
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 
-from cloud_storage_oci import *
+from admission_control import AdmissionMiddleware, get_admission_metrics
+from audio_pool import shutdown_pool
+from audio_probe import AudioRejected, check_encoded_audio
+from audio_verifier_util import is_url
 from config_util import get_config_value
-from few_shot_util import *
-from io_processing import *
+from deadline import DeadlineExceeded, DeadlineMiddleware, run_stage
+from few_shot_util import extract_answer, extract_batch_answers, get_llm_metrics
+from idempotency import IdempotencyMiddleware, get_idempotency_metrics
+from io_processing import convert_text_to_audio, publish_audio_file, transcribe_audio_to_reg_eng_text, \
+    translate_audio, translate_text, translate_text_to_english
 from logger import logger
+from server_timing import ServerTimingMiddleware, record_since_last_span
+from speech_streaming import stream_text_to_audio
 from telemetry_middleware import TelemetryMiddleware
+from transcript_cache import get_transcript_cache_metrics
+from translator import audio_input_to_text, indic_translation_batch
+from warmup import is_ready, warm_up
 
 app = FastAPI()
 
@@ -22,6 +38,10 @@ class ContextRequest(BaseModel):
     language: str = None
 
 
+class ContextBatchRequest(BaseModel):
+    items: List[ContextRequest]
+
+
 class QueryInputModel(BaseModel):
     language: str = None
     text: str = None
@@ -32,6 +52,7 @@ class QueryOutputModel(BaseModel):
     format: str = None
     audio: str = None
     language: str = None
+    stream: bool = False
 
 
 class TranslationRequest(BaseModel):
@@ -50,11 +71,49 @@ class TranslationResponse(BaseModel):
 
 
 language_code_list = get_config_value('lang_code', 'supported_lang_codes', None).split(",")
+context_batch_max_items = int(get_config_value('context_batch', 'max_items', None))
+context_batch_llm_size = int(get_config_value('context_batch', 'llm_batch_size', None))
+context_batch_translation_size = int(get_config_value('context_batch', 'translation_batch_size', None))
+# Languages whose /v1/context queries are given to the LLM as they are, with the translation to English run alongside
+native_context_languages = {language.strip() for language in
+                            (get_config_value('llm', 'native_context_languages', None) or "").split(",")
+                            if language.strip() and language.strip() != "en"}
 
 
 
+# Admission control and load shedding middleware
+app.add_middleware(AdmissionMiddleware)
+# Idempotency-Key middleware, outside of admission control so that waiting and replayed duplicates take no slot
+app.add_middleware(IdempotencyMiddleware)
 # Telemetry API logs middleware
 app.add_middleware(TelemetryMiddleware)
+# Request deadline and client disconnect middleware
+app.add_middleware(DeadlineMiddleware)
+# Server-Timing header and on-demand profiling middleware
+app.add_middleware(ServerTimingMiddleware)
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    logger.warning({"label": "deadline_exceeded", "stage": exc.stage, "reason": exc.reason})
+    return JSONResponse(status_code=504, content={"detail": f"Request deadline exceeded at stage: {exc.stage}"})
+
+
+@app.exception_handler(AudioRejected)
+async def audio_rejected_handler(request: Request, exc: AudioRejected):
+    logger.warning({"label": "audio_rejected", "status_code": exc.status_code, "reason": exc.detail})
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    # Warm up in the background, so that /health answers while the worker is getting ready
+    asyncio.get_running_loop().run_in_executor(None, warm_up)
+
+
+@app.on_event("shutdown")
+async def stop_audio_pool():
+    await asyncio.get_running_loop().run_in_executor(None, shutdown_pool)
 
 
 @app.get(
@@ -79,8 +138,48 @@ def get_health() -> HealthCheck:
     return HealthCheck(status="OK")
 
 
+@app.get(
+    "/ready",
+    tags=["Health Check"],
+    summary="Perform a Readiness Check",
+    response_description="Return HTTP Status Code 200 (OK) once the worker is warmed up",
+    status_code=status.HTTP_200_OK,
+    response_model=HealthCheck,
+    include_in_schema=True
+)
+def get_ready():
+    """
+    ## Perform a Readiness Check
+    Endpoint to check whether the worker has completed its warm-up, i.e. heavy modules and clients are initialized,
+    the few-shot prompt is rendered and connections to Bhashini, OCI and Azure OpenAI are opened. It returns HTTP
+    Status Code 503 until then, so that traffic is only routed to the worker once it can serve requests quickly.
+    Returns:
+        HealthCheck: Returns a JSON response with the readiness status
+    """
+    if not is_ready():
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"status": "WARMING_UP"})
+    return HealthCheck(status="OK")
+
+
+@app.get(
+    "/metrics",
+    tags=["Health Check"],
+    summary="Service metrics",
+    include_in_schema=True
+)
+def get_metrics():
+    """
+    ## Service metrics
+    Returns the queue depth, concurrency and shed counts of every admission control lane of this worker, the
+    hit rate and latency of every LLM tier, the hit rate of the transcript cache and the idempotent replays.
+    """
+    return {"admission": get_admission_metrics(), "llm": get_llm_metrics(),
+            "transcript_cache": get_transcript_cache_metrics(), "idempotency": get_idempotency_metrics()}
+
+
 @app.post("/v1/context", tags=["API for fetching query context information"])
 async def query_context_extraction(request: ContextRequest):
+    record_since_last_span("validation")
     load_dotenv()
 
     text = None
@@ -88,7 +187,6 @@ async def query_context_extraction(request: ContextRequest):
     source_language = None
     updated_answer = None
 
-    min_words_length = get_config_value('min_words', 'length', None)
     logger.info({"text": request.text, "audio": request.audio, "source_language": request.language})
     if request.text is not None:
         text = request.text.strip()
@@ -114,37 +212,35 @@ async def query_context_extraction(request: ContextRequest):
         except Exception:
             raise HTTPException(status_code=400, detail="Unsupported language!")
 
-        if text is not None and text != "":
-            logger.info({"text": text, "source_language": source_language})
-            src_lang_text = text
-            eng_text, error_message = translate_text_to_english(text, source_language)
-            if error_message:
-                raise HTTPException(status_code=503, detail="Failed to translate!")
+        if source_language in native_context_languages:
+            if text is not None and text != "":
+                src_lang_text = text
+            else:
+                verify_audio_input(audio)
+                src_lang_text = await run_stage(audio_input_to_text, audio, source_language)
+                if src_lang_text is None:
+                    raise HTTPException(status_code=503, detail="Failed to translate!")
+            eng_text, answer = await extract_native_context(src_lang_text, source_language)
+            updated_answer = build_context(eng_text or src_lang_text, answer)
         else:
-            if not is_url(audio) and not is_base64(audio):
-                raise HTTPException(status_code=422, detail="Invalid audio input!")
-            logger.info({"source_language:", source_language})
-            src_lang_text, eng_text, error_message = transcribe_audio_to_reg_eng_text(audio, source_language)
-            if error_message:
-                raise HTTPException(status_code=503, detail="Failed to translate!")
-            logger.info({"src_lang_text:", src_lang_text, "eng_text:", eng_text})
-
-        logger.info({"query": eng_text})
-        try:
-            response = invokeLLM(eng_text)
-            response = "{" + response["content"] + "}"
-            json_resp = json.loads(response)
-            answer: dict = json_resp["answer"]
-            logger.info("answer:: ", answer)
-        except Exception as ex:
-            answer = None
-            logger.info(ex)
-            logger.error(f"Exception occurred: {ex}", exc_info=True)
-
-    if len(eng_text.split(" ")) < int(min_words_length):
-        updated_answer = {"keywords": answer["keywords"]} if answer is not None and "keywords" in answer else None
-    else:
-        updated_answer = remove_keys_with_any(answer) if answer is not None else None
+            if text is not None and text != "":
+                logger.info({"text": text, "source_language": source_language})
+                src_lang_text = text
+                eng_text, error_message = await run_stage(translate_text_to_english, text, source_language)
+                if error_message:
+                    raise HTTPException(status_code=503, detail="Failed to translate!")
+            else:
+                verify_audio_input(audio)
+                logger.info({"source_language:", source_language})
+                src_lang_text, eng_text, error_message = await run_stage(transcribe_audio_to_reg_eng_text, audio,
+                                                                         source_language)
+                if error_message:
+                    raise HTTPException(status_code=503, detail="Failed to translate!")
+                logger.info({"src_lang_text:", src_lang_text, "eng_text:", eng_text})
+
+            logger.info({"query": eng_text})
+            answer = await extract_context_answer(eng_text)
+            updated_answer = build_context(eng_text, answer)
 
     response = {
         "input": {
@@ -157,8 +253,96 @@ async def query_context_extraction(request: ContextRequest):
     return response
 
 
+@app.post("/v1/context/batch", tags=["API for fetching query context information"])
+async def query_context_extraction_batch(request: ContextBatchRequest):
+    record_since_last_span("validation")
+    load_dotenv()
+
+    if not request.items:
+        raise HTTPException(status_code=422, detail="At least one item should be present!")
+    if len(request.items) > context_batch_max_items:
+        raise HTTPException(status_code=422, detail=f"At most {context_batch_max_items} items are allowed!")
+
+    results = [{"input": {"sourceText": None, "englishText": None}, "context": None, "error": None}
+               for _ in request.items]
+    indexes_by_language = {}
+    for index, item in enumerate(request.items):
+        text = item.text.strip() if item.text is not None else ""
+        source_language = item.language.strip().lower() if item.language is not None else ""
+        if item.audio is not None and item.audio.strip() != "":
+            results[index]["error"] = "Only 'text' is allowed in batch requests!"
+        elif text == "":
+            results[index]["error"] = "'text' should be present!"
+        elif source_language == "" or source_language not in language_code_list:
+            results[index]["error"] = "Unsupported language!"
+        else:
+            results[index]["input"]["sourceText"] = text
+            indexes_by_language.setdefault(source_language, []).append(index)
+    logger.info({"items": len(results), "languages": {language: len(indexes)
+                                                      for language, indexes in indexes_by_language.items()}})
+
+    # One Bhashini call per source language and chunk of texts
+    chunks = [(source_language, indexes[start:start + context_batch_translation_size])
+              for source_language, indexes in indexes_by_language.items()
+              for start in range(0, len(indexes), context_batch_translation_size)]
+    outcomes = await asyncio.gather(*(run_stage(indic_translation_batch,
+                                                [results[index]["input"]["sourceText"] for index in chunk],
+                                                source_language, "en")
+                                      for source_language, chunk in chunks), return_exceptions=True)
+    for (_, chunk), outcome in zip(chunks, outcomes):
+        if isinstance(outcome, DeadlineExceeded):
+            raise outcome
+        if isinstance(outcome, Exception):
+            logger.error(f"Exception occurred: {outcome}", exc_info=outcome)
+        elif len(outcome) != len(chunk):
+            logger.error({"label": "batch_translation_mismatch", "texts": len(chunk), "translations": len(outcome)})
+        for position, index in enumerate(chunk):
+            if isinstance(outcome, Exception) or position >= len(outcome):
+                results[index]["error"] = "Failed to translate!"
+            else:
+                results[index]["input"]["englishText"] = outcome[position]
+
+    # Several questions per LLM call, questions without a parsable answer are asked again one by one
+    questions = [index for index, result in enumerate(results) if result["input"]["englishText"] is not None]
+    packs = [questions[start:start + context_batch_llm_size]
+             for start in range(0, len(questions), context_batch_llm_size)]
+    outcomes = await asyncio.gather(*(run_stage(extract_batch_answers,
+                                                [results[index]["input"]["englishText"] for index in pack])
+                                      for pack in packs), return_exceptions=True)
+    answers = {}
+    fallback = []
+    for pack, outcome in zip(packs, outcomes):
+        if isinstance(outcome, DeadlineExceeded):
+            raise outcome
+        if isinstance(outcome, Exception):
+            logger.error(f"Exception occurred: {outcome}", exc_info=outcome)
+            fallback.extend(pack)
+            continue
+        for index, answer in zip(pack, outcome):
+            if answer is None:
+                fallback.append(index)
+            else:
+                answers[index] = answer
+    if fallback:
+        logger.info({"label": "context_batch_fallback", "items": len(fallback)})
+        outcomes = await asyncio.gather(*(run_stage(extract_answer, results[index]["input"]["englishText"])
+                                          for index in fallback), return_exceptions=True)
+        for index, outcome in zip(fallback, outcomes):
+            if isinstance(outcome, DeadlineExceeded):
+                raise outcome
+            if isinstance(outcome, Exception):
+                logger.error(f"Exception occurred: {outcome}", exc_info=outcome)
+            else:
+                answers[index] = outcome
+
+    for index in questions:
+        results[index]["context"] = build_context(results[index]["input"]["englishText"], answers.get(index))
+    return {"items": results}
+
+
 @app.post("/v1/translation", tags=["API for translation of text and audio in English and Indic languages"])
 async def translator(request: TranslationRequest) -> TranslationResponse:
+    record_since_last_span("validation")
     load_dotenv()
     text = None
     audio = None
@@ -167,6 +351,7 @@ async def translator(request: TranslationRequest) -> TranslationResponse:
     target_format = None
     trans_text = None
     trans_audio = None
+    stream_audio = request.output.stream
 
     if request.input.text is not None:
         text = request.input.text.strip()
@@ -214,36 +399,45 @@ async def translator(request: TranslationRequest) -> TranslationResponse:
         if target_format == "text" and text is not None and text != "":
             logger.info("TRANSLATE TEXT TO TEXT OF OTHER LANGUAGE::: ")
             logger.info({"text": text, "source_language": source_language, "target_language": target_language})
-            trans_text, error_message = translate_text(text, source_language, target_language)
+            trans_text, error_message = await run_stage(translate_text, text, source_language, target_language)
         elif target_format == "audio" and text is not None and text != "" and source_language == target_language:
             logger.info("TRANSLATE TEXT TO AUDIO OF SAME LANGUAGE::: ")
             logger.info({"text": text, "source_language": source_language})
-            trans_audio = convert_to_audio(text, source_language)
+            if stream_audio:
+                return await stream_text_to_audio(text, source_language)
+            trans_audio = await run_stage(convert_to_audio, text, source_language)
         elif target_format == "audio" and text is not None and text != "" and source_language != target_language:
             logger.info("TRANSLATE TEXT TO AUDIO OF OTHER LANGUAGE::: ")
             logger.info({"text": text, "source_language": source_language, "target_language": target_language})
-            trans_text, error_message = translate_text(text, source_language, target_language)
-            trans_audio = convert_to_audio(trans_text, target_language)
+            trans_text, error_message = await run_stage(translate_text, text, source_language, target_language)
+            if stream_audio:
+                if trans_text is None:
+                    raise HTTPException(status_code=503, detail="Failed to translate!")
+                return await stream_text_to_audio(trans_text, target_language, translated_text=trans_text)
+            trans_audio = await run_stage(convert_to_audio, trans_text, target_language)
         elif target_format == "text" and audio is not None and audio != "" and source_language == target_language:
-            if not is_url(audio) and not is_base64(audio):
-                raise HTTPException(status_code=422, detail="Invalid audio input!")
+            verify_audio_input(audio)
             logger.info("TRANSLATE AUDIO TO TEXT OF SAME LANGUAGE::: ")
             logger.info({"text": text, "source_language": source_language})
-            trans_text = audio_input_to_text(audio, source_language)
+            trans_text = await run_stage(audio_input_to_text, audio, source_language)
         elif target_format == "text" and audio is not None and audio != "" and source_language != target_language:
-            if not is_url(audio) and not is_base64(audio):
-                raise HTTPException(status_code=422, detail="Invalid audio input!")
+            verify_audio_input(audio)
             logger.info("TRANSLATE AUDIO TO TEXT OF OTHER LANGUAGE::: ")
             logger.info({"text": text, "source_language": source_language, "target_language": target_language})
-            trans_text_same_lang = audio_input_to_text(audio, source_language)
-            trans_text, error_message = translate_text(trans_text_same_lang, source_language, target_language)
+            _, trans_text, _, error_message = await run_stage(translate_audio, audio, source_language,
+                                                              target_language)
         elif target_format == "audio" and audio is not None and audio != "":
-            if not is_url(audio) and not is_base64(audio):
-                raise HTTPException(status_code=422, detail="Invalid audio input!")
+            verify_audio_input(audio)
             logger.info("TRANSLATE AUDIO TO AUDIO OF OTHER LANGUAGE::: ")
-            src_trans_text = audio_input_to_text(audio, source_language)
-            trans_text, error_message = translate_text(src_trans_text, source_language, target_language)
-            trans_audio = convert_to_audio(trans_text, target_language)
+            if stream_audio:
+                _, trans_text, _, error_message = await run_stage(translate_audio, audio, source_language,
+                                                                  target_language)
+                if trans_text is None:
+                    raise HTTPException(status_code=503, detail="Failed to translate!")
+                return await stream_text_to_audio(trans_text, target_language, translated_text=trans_text)
+            _, trans_text, output_file, error_message = await run_stage(translate_audio, audio, source_language,
+                                                                        target_language, synthesize=True)
+            trans_audio = await run_stage(publish_audio, output_file)
 
     response = TranslationResponse()
     op_resp = OutputResponse()
@@ -256,15 +450,74 @@ async def translator(request: TranslationRequest) -> TranslationResponse:
 
 def convert_to_audio(text, target_language):
     output_file, error_message = convert_text_to_audio(text, target_language)
+    return publish_audio(output_file)
+
+
+def publish_audio(output_file):
     if output_file is not None:
-        upload_file_object(output_file.name)
-        trans_audio_url, error_message = give_public_url(output_file.name)
-        logger.debug("Audio Output URL:: ", trans_audio_url)
-        output_file.close()
-        os.remove(output_file.name)
-        return trans_audio_url
-    else:
-        raise HTTPException(status_code=503, detail="Failed to generate a response!")
+        trans_audio_url, error_message = publish_audio_file(output_file)
+        logger.debug({"audio_output_url": trans_audio_url})
+        if trans_audio_url is not None:
+            return trans_audio_url
+        logger.error({"label": "audio_publish_failed", "error": error_message})
+    raise HTTPException(status_code=503, detail="Failed to generate a response!")
+
+
+async def extract_context_answer(question, language=None):
+    """
+    Returns:
+        The LLM's answer to the question, or None if the LLM call failed.
+    """
+    try:
+        answer = await run_stage(extract_answer, question, language)
+        logger.info({"answer": answer})
+        return answer
+    except DeadlineExceeded:
+        raise
+    except Exception as ex:
+        logger.info(ex)
+        logger.error(f"Exception occurred: {ex}", exc_info=True)
+        return None
+
+
+async def extract_native_context(src_lang_text, source_language):
+    """
+    Asks the LLM for the context of the query in its own language, while the query is translated to English for the
+    response, so that the translation is not on the critical path.
+
+    Returns:
+        The English translation, None if the translation failed, and the LLM's answer.
+    """
+    translation = asyncio.ensure_future(run_stage(translate_text_to_english, src_lang_text, source_language))
+    try:
+        answer = await extract_context_answer(src_lang_text, source_language)
+    except BaseException:
+        translation.cancel()
+        raise
+    eng_text, error_message = await translation
+    if error_message:
+        logger.warning({"label": "native_context_translation_failed", "source_language": source_language})
+    logger.info({"src_lang_text": src_lang_text, "eng_text": eng_text, "answer": answer})
+    return eng_text, answer
+
+
+def verify_audio_input(audio):
+    """
+    Rejects invalid, unsupported and over-limit base64 audio from its first bytes, before it is decoded. Audio URLs
+    are checked while they are downloaded.
+    """
+    if not is_url(audio):
+        check_encoded_audio(audio)
+
+
+def build_context(eng_text, answer):
+    """
+    Keeps only the keywords of the answer for short queries, otherwise drops the attributes answered with "Any".
+    """
+    min_words_length = get_config_value('min_words', 'length', None)
+    if len(eng_text.split(" ")) < int(min_words_length):
+        return {"keywords": answer["keywords"]} if answer is not None and "keywords" in answer else None
+    return remove_keys_with_any(answer) if answer is not None else None
 
 
 def remove_keys_with_any(dict_obj):
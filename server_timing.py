@@ -0,0 +1,199 @@
+import asyncio
+import contextvars
+import hmac
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from config_util import get_config_value
+from logger import logger
+
+server_timing_enabled = get_config_value('profiling', 'server_timing_enabled', None).lower() == "true"
+profile_header = get_config_value('profiling', 'profile_header', None).lower()
+# Shared secret a client has to send in the profile header, profiling is disabled without it
+profile_token = get_config_value('profiling', 'profile_token', None) or ""
+profile_directory = get_config_value('profiling', 'profile_directory', None)
+profile_interval = float(get_config_value('profiling', 'profile_interval_ms', None)) / 1000
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler for a single request. Periodically samples the stacks of the threads working for
+    the request, i.e. the event loop thread and the thread pool threads running its stages, and counts them as
+    folded stacks, the input format of flame graph tools.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.threads = {threading.get_ident()}
+        self.stacks = Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            self.samples += 1
+            for ident in list(self.threads):
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[fold_stack(frame)] += 1
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as profile_file:
+            for stack, count in self.stacks.most_common():
+                profile_file.write(f"{stack} {count}\n")
+
+
+def fold_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Timings:
+    """
+    Durations of the stages of one request. Spans still running are reported with their duration so far, so that a
+    request aborted by its deadline shows the stage it was stuck in.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+        self.profiler = None
+
+    def add(self, name, start, end=None):
+        entry = [name, start, end]
+        self.spans.append(entry)
+        return entry
+
+    def header_value(self):
+        now = time.perf_counter()
+        durations = {}
+        for name, start, end in list(self.spans):
+            durations[name] = durations.get(name, 0.0) + (end or now) - start
+        metrics = [f"{name};dur={duration * 1000:.1f}" for name, duration in durations.items()]
+        metrics.append(f"total;dur={(now - self.start) * 1000:.1f}")
+        return ", ".join(metrics)
+
+
+_current_timings = contextvars.ContextVar("server_timing", default=None)
+
+
+@contextmanager
+def span(name):
+    """
+    Records the duration of a stage of the current request, if any, in its Server-Timing header. Durations of
+    stages with the same name, e.g. the tiers of the LLM cascade, are summed up.
+    """
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+    entry = timings.add(name, time.perf_counter())
+    try:
+        yield
+    finally:
+        entry[2] = time.perf_counter()
+
+
+def record_since_last_span(name):
+    """
+    Records the time since the last finished span, or since the start of the request, as a span, e.g. the time
+    taken to read and validate the request before the endpoint runs.
+    """
+    timings = _current_timings.get()
+    if timings is None:
+        return
+    ends = [end for _, _, end in list(timings.spans) if end is not None]
+    timings.add(name, max(ends, default=timings.start), time.perf_counter())
+
+
+def run_traced(func, *args, **kwargs):
+    """
+    Runs a blocking stage of the current request, with the running thread sampled by the request's profiler.
+    """
+    timings = _current_timings.get()
+    profiler = timings.profiler if timings is not None else None
+    if profiler is None:
+        return func(*args, **kwargs)
+    ident = threading.get_ident()
+    profiler.threads.add(ident)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.threads.discard(ident)
+
+
+def is_profile_requested(headers):
+    value = headers.get(profile_header.encode("latin-1"))
+    return bool(profile_token) and value is not None and hmac.compare_digest(value, profile_token.encode("latin-1"))
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware adding a Server-Timing header with the duration of every stage to the responses. A request
+    carrying the profile header with the configured token is also profiled, its folded stacks are stored in the
+    profile directory under the name returned in the X-Profile-File header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (server_timing_enabled or profile_token):
+            await self.app(scope, receive, send)
+            return
+
+        timings = Timings()
+        profile_path = None
+        if profile_token and is_profile_requested(dict(scope["headers"])):
+            name = scope["path"].strip("/").replace("/", "_") or "root"
+            profile_path = os.path.join(profile_directory,
+                                        f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{uuid.uuid4().hex[:8]}.folded")
+            timings.profiler = SamplingProfiler(profile_interval)
+            timings.profiler.start()
+
+        async def timing_send(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                if server_timing_enabled:
+                    headers.append((b"server-timing", timings.header_value().encode("latin-1")))
+                if profile_path is not None:
+                    headers.append((b"x-profile-file", os.path.basename(profile_path).encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = _current_timings.set(timings)
+        try:
+            await self.app(scope, receive, timing_send)
+        finally:
+            _current_timings.reset(token)
+            if timings.profiler is not None:
+                await asyncio.get_running_loop().run_in_executor(None, self._save_profile, timings.profiler,
+                                                                 profile_path)
+
+    @staticmethod
+    def _save_profile(profiler, profile_path):
+        profiler.stop()
+        try:
+            profiler.save(profile_path)
+            logger.info({"label": "request_profiled", "file": profile_path, "samples": profiler.samples})
+        except OSError as e:
+            logger.error(f"Saving profile {profile_path} failed: {e}")
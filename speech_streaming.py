@@ -0,0 +1,179 @@
+import asyncio
+import re
+from collections import deque
+from urllib.parse import quote
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from audio_pool import run_transform
+from audio_transform import encode_mp3
+from cloud_storage_oci import give_public_url
+from config_util import get_config_value
+from deadline import DeadlineExceeded, run_stage
+from io_processing import generate_output_filename, publish_audio_file, save_audio_output
+from logger import logger
+from translator import text_to_speech
+
+tts_lookahead = int(get_config_value('tts_stream', 'lookahead', None))
+min_sentence_length = int(get_config_value('tts_stream', 'min_sentence_length', None))
+max_sentence_length = int(get_config_value('tts_stream', 'max_sentence_length', None))
+publish_streamed_audio = get_config_value('tts_stream', 'publish_audio', None).lower() == "true"
+# Proxies reject responses with large headers, nginx allows 4 to 8 KB for all of them by default
+max_translation_header_length = int(get_config_value('tts_stream', 'max_translation_header_length', None))
+
+# Sentence ends in Latin and Indic scripts (danda, double danda)
+sentence_end_pattern = re.compile(r"(?<=[.!?।॥])\s+|\n+")
+clause_end_pattern = re.compile(r"(?<=[,;:])\s+")
+
+
+def split_sentences(text):
+    """
+    Splits a text into the pieces synthesized one at a time. Short sentences are merged with the next one, to save
+    calls, and long sentences are split at clause ends or spaces, to keep the time to first audio low.
+    """
+    pieces = []
+    for sentence in sentence_end_pattern.split(text.strip()):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if pieces and len(pieces[-1]) < min_sentence_length:
+            pieces[-1] = f"{pieces[-1]} {sentence}"
+        else:
+            pieces.append(sentence)
+
+    sentences = []
+    for piece in pieces:
+        while len(piece) > max_sentence_length:
+            head = piece[:max_sentence_length]
+            cut = max((match.end() for match in clause_end_pattern.finditer(head)), default=0) or \
+                head.rfind(" ") + 1 or max_sentence_length
+            sentences.append(piece[:cut].strip())
+            piece = piece[cut:].strip()
+        if piece:
+            sentences.append(piece)
+    return sentences
+
+
+def synthesize_sentence(sentence, language):
+    """
+    Returns:
+        The MP3 encoded speech of the sentence.
+    """
+    decoded_audio_content = text_to_speech(language=language, text=sentence)
+    if not decoded_audio_content:
+        raise RuntimeError("Text to Audio conversion failed")
+    return run_transform(encode_mp3, decoded_audio_content)
+
+
+def translation_header(translated_text):
+    """
+    Returns:
+        The URL encoded translation for the X-Translation-Text header, cut at a character boundary to fit
+        max_translation_header_length, and whether it was cut.
+    """
+    quoted_text = quote(translated_text)
+    if len(quoted_text) <= max_translation_header_length:
+        return quoted_text, False
+    length = 0
+    end = 0
+    for end, character in enumerate(translated_text):
+        length += len(quote(character))
+        if length > max_translation_header_length:
+            break
+    return quote(translated_text[:end]), True
+
+
+def publish_audio_content(audio_content, filename, audio_url):
+    output_file, error_message = save_audio_output(audio_content, filename)
+    if output_file is not None:
+        try:
+            _, error_message = publish_audio_file(output_file)
+        except Exception as e:
+            # Also when the upload is skipped because the request's deadline is used up
+            error_message = str(e)
+    if error_message:
+        logger.error({"label": "streamed_audio_not_published", "url": audio_url, "error": error_message})
+
+
+async def stream_text_to_audio(text, language, translated_text=None):
+    """
+    Synthesizes the text sentence by sentence and streams the MP3 audio as a chunked response. The synthesis of the
+    next sentences runs while the current one is sent, so that the listener only waits for the first sentence.
+    The concatenated audio is published to OCI object storage after the response, under the URL returned in the
+    X-Audio-Url header. The header is sent before the upload, which is best effort: the audio is not published when
+    the stream is aborted, the upload fails or the request's deadline is used up, which is logged with the URL.
+    """
+    sentences = split_sentences(text or "")
+    if not sentences:
+        raise HTTPException(status_code=503, detail="Failed to generate a response!")
+
+    def synthesize(index):
+        return asyncio.ensure_future(run_stage(synthesize_sentence, sentences[index], language))
+
+    pending = deque(synthesize(index) for index in range(min(len(sentences), 1 + tts_lookahead)))
+    next_index = len(pending)
+    try:
+        first_chunk = await pending[0]
+    except DeadlineExceeded:
+        for task in pending:
+            task.cancel()
+        raise
+    except Exception as e:
+        for task in pending:
+            task.cancel()
+        logger.error(f"Exception occurred: {e}", exc_info=True)
+        raise HTTPException(status_code=503, detail="Failed to generate a response!")
+
+    chunks = []
+    audio_url = None
+
+    async def audio_chunks():
+        nonlocal next_index
+        try:
+            while pending:
+                chunk = await pending.popleft()
+                if next_index < len(sentences):
+                    pending.append(synthesize(next_index))
+                    next_index += 1
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            # The response has started, the stream can only be cut short. The error is raised again so that the
+            # server aborts the chunked response instead of ending it like a complete one.
+            logger.error(f"Streaming speech failed after {len(chunks)} of {len(sentences)} sentences: {e}",
+                         exc_info=True)
+            if audio_url is not None:
+                logger.error({"label": "streamed_audio_not_published", "url": audio_url})
+            chunks.clear()
+            raise
+        finally:
+            for task in pending:
+                task.cancel()
+
+    headers = {"X-Sentence-Count": str(len(sentences))}
+    if translated_text is not None:
+        headers["X-Translation-Text"], truncated = translation_header(translated_text)
+        if truncated:
+            headers["X-Translation-Truncated"] = "true"
+    background = None
+    if publish_streamed_audio:
+        filename = generate_output_filename()
+        audio_url, error_message = give_public_url(filename)
+        if audio_url is not None:
+            headers["X-Audio-Url"] = audio_url
+
+            async def publish():
+                if not chunks:
+                    return
+                try:
+                    await run_stage(publish_audio_content, b"".join(chunks), filename, audio_url)
+                except asyncio.CancelledError:
+                    logger.error({"label": "streamed_audio_not_published", "url": audio_url,
+                                  "error": "request deadline exceeded"})
+                    raise
+
+            background = BackgroundTask(publish)
+    logger.debug({"label": "speech_stream_started", "sentences": len(sentences), "first_chunk": len(first_chunk)})
+    return StreamingResponse(audio_chunks(), media_type="audio/mpeg", headers=headers, background=background)
@@ -1,6 +1,8 @@
+import gzip
 import time
 import uuid
 
+import orjson
 import requests
 
 from config_util import get_config_value
@@ -15,6 +17,24 @@ actor_id = get_config_value('telemetry', 'actor_id', None)
 channel = get_config_value('telemetry', 'channel', None)
 pdata_id = get_config_value('telemetry', 'pdata_id', None)
 events_threshold = get_config_value('telemetry', 'events_threshold', None)
+# Flattened body keys which are sent as event params, anything else (e.g. audio content) is dropped
+params_allow_list = {key.strip() for key in get_config_value('telemetry', 'params_allow_list', None).split(",")}
+max_param_length = int(get_config_value('telemetry', 'max_param_length', None))
+compress_batches = get_config_value('telemetry', 'compress_batches', None).lower() == "true"
+
+
+def cap_value(value, max_length=max_param_length):
+    """
+    Caps the encoded size of a telemetry field. Oversized strings are truncated and oversized lists or dicts are
+    replaced by their truncated JSON encoding.
+    """
+    if isinstance(value, str):
+        return value if len(value) <= max_length else value[:max_length] + "..."
+    if isinstance(value, (list, dict)):
+        encoded = orjson.dumps(value, default=str).decode("utf-8")
+        return value if len(encoded) <= max_length else encoded[:max_length] + "..."
+    return value
+
 
 class TelemetryLogger:
     """
@@ -33,7 +53,7 @@ class TelemetryLogger:
         **kwargs:** Keyword arguments containing the event data.
         """
 
-        logger.info(f"Telemetry event: {event}")
+        logger.info({"label": "telemetry_event", "event": event})
 
         if not TELEMETRY_LOG_ENABLED:
             return
@@ -56,9 +76,13 @@ class TelemetryLogger:
                 "events": self.events
             }
             headers = {"Content-Type": "application/json"}
-            response = requests.post(self.url + "/v1/telemetry", json=data, headers=headers)
+            body = orjson.dumps(data, default=str)
+            if compress_batches:
+                body = gzip.compress(body, compresslevel=5)
+                headers["Content-Encoding"] = "gzip"
+            response = requests.post(self.url + "/v1/telemetry", data=body, headers=headers)
             response.raise_for_status()
-            logger.debug(f"Telemetry API request data: {data}")
+            logger.debug({"label": "telemetry_batch", "events": len(self.events), "bytes": len(body)})
             logger.info("Telemetry logs sent successfully!")
             # Reset captured events after sending
             self.events = []
@@ -98,7 +122,7 @@ class TelemetryLogger:
             "edata": {
                 "type": etype,
                 "level": elevel,
-                "message": str(message).replace("'", "")
+                "message": cap_value(str(message).replace("'", ""))
             }
         }
 
@@ -142,7 +166,8 @@ class TelemetryLogger:
         flattened_dict = self.__flatten_dict(eventInput.get("body", {}))
         if bool(flattened_dict):
             for item in flattened_dict.items():
-                eventEDataParams.append({item[0]: item[1]})
+                if item[0] in params_allow_list:
+                    eventEDataParams.append({item[0]: cap_value(item[1])})
 
         return eventEDataParams
 
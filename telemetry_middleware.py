@@ -9,8 +9,16 @@ from starlette.types import Message
 from logger import logger
 
 async def set_body(request: Request, body: bytes):
+    original_receive = request._receive
+    body_sent = False
+
     async def receive() -> Message:
-        return {"type": "http.request", "body": body}
+        # The body is replayed once, later calls wait for the client's disconnect, e.g. in a streaming response
+        nonlocal body_sent
+        if body_sent:
+            return await original_receive()
+        body_sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
 
     request._receive = receive
 
@@ -34,7 +42,6 @@ class TelemetryMiddleware(BaseHTTPMiddleware):
 
     async def dispatch(self, request: Request, call_next):
         start_time = time.time()
-        await set_body(request, await request.body())
         body = await get_body(request)
         if body.decode("utf-8"):
             body = json.loads(body)
@@ -0,0 +1,75 @@
+import hashlib
+import struct
+
+from cache_store import TieredCache
+from config_util import get_config_value
+
+transcript_cache_enabled = get_config_value('cache', 'transcript_cache_enabled', None).lower() == "true"
+transcript_cache = TieredCache(
+    "transcripts",
+    ttl_seconds=float(get_config_value('cache', 'transcript_cache_ttl_seconds', None)),
+    max_entries=int(get_config_value('cache', 'transcript_cache_max_entries', None)),
+    directory=get_config_value('cache', 'cache_directory', None),
+    max_disk_entries=int(get_config_value('cache', 'cache_max_disk_entries', None))
+)
+
+
+def wav_samples(wav_file_content):
+    """
+    Returns the samples of a WAV file, i.e. the content of its "data" chunk, without the header.
+    """
+    position = 12
+    while position + 8 <= len(wav_file_content):
+        chunk_id, chunk_size = struct.unpack_from("<4sI", wav_file_content, position)
+        if chunk_id == b"data":
+            return wav_file_content[position + 8:position + 8 + chunk_size]
+        position += 8 + chunk_size + (chunk_size & 1)
+    return wav_file_content
+
+
+def audio_fingerprint(wav_file_content, language, service_id):
+    """
+    Fingerprint of a recording for an ASR service. Only the normalized 16 kHz mono PCM samples are hashed, so that
+    the same recording gives the same fingerprint whatever its original container and encoding was.
+    """
+    digest = hashlib.sha256(f"{language}:{service_id}:".encode("utf-8"))
+    digest.update(wav_samples(wav_file_content))
+    return digest.hexdigest()
+
+
+def get_cached_transcript(wav_file_content, language, service_id, output_language=None):
+    """
+    Returns:
+        The cached transcript of the recording and its cached translation to the output language, each None if
+        not cached.
+    """
+    if not transcript_cache_enabled:
+        return None, None
+    entry = transcript_cache.get(audio_fingerprint(wav_file_content, language, service_id))
+    if entry is None:
+        return None, None
+    if output_language is None or output_language == language:
+        return entry["transcript"], entry["transcript"]
+    return entry["transcript"], entry["translations"].get(output_language)
+
+
+def cache_transcript(wav_file_content, language, service_id, transcript, output_language=None, translation=None):
+    """
+    Stores the transcript of a recording and, optionally, its translation to the output language next to the
+    translations already cached.
+    """
+    if not transcript_cache_enabled or transcript is None:
+        return
+    key = audio_fingerprint(wav_file_content, language, service_id)
+    entry = transcript_cache.peek(key)
+    if entry is None or entry["transcript"] != transcript:
+        entry = {"transcript": transcript, "translations": {}}
+    else:
+        entry = {"transcript": transcript, "translations": dict(entry["translations"])}
+    if output_language is not None and output_language != language and translation is not None:
+        entry["translations"][output_language] = translation
+    transcript_cache.set(key, entry)
+
+
+def get_transcript_cache_metrics():
+    return transcript_cache.metrics()
@@ -4,13 +4,27 @@ import os
 import time
 
 import requests
-from pydub import AudioSegment
+from requests.adapters import HTTPAdapter
 
-from audio_verifier_util import is_url, is_base64, generate_temp_filename
+from audio_pool import run_transform
+from audio_probe import AudioRejected, check_audio, check_content_headers, check_encoded_audio, max_audio_bytes, \
+    probe_bytes
+from audio_transform import normalize_audio, normalize_encoded_audio
+from audio_verifier_util import is_url, is_base64
+from config_util import get_config_value
+from deadline import DeadlineExceeded, check_deadline, stage_timeout
+from server_timing import span
 from telemetry_logger import TelemetryLogger
+from transcript_cache import cache_transcript, get_cached_transcript
 
 telemetryLogger =  TelemetryLogger()
 
+# Pooled HTTP session shared by all upstream calls, so that connections are reused across requests
+http_pool_size = int(get_config_value('warmup', 'http_pool_size', None))
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_maxsize=http_pool_size))
+http_session.mount("http://", HTTPAdapter(pool_maxsize=http_pool_size))
+
 asr_mapping = {
     "bn": "ai4bharat/conformer-multilingual-indo_aryan-gpu--t4",
     "en": "ai4bharat/whisper-medium-en--gpu--t4",
@@ -72,35 +86,69 @@ def log_failed_telemetry_event(url, method,  payload, process_time, status_code,
     event = telemetryLogger.prepare_log_event(eventInput=event,etype="api_call", elevel="ERROR", message=error)
     telemetryLogger.add_event(event)
 
+def download_audio(url):
+    """
+    Downloads audio, rejecting it from the response headers and its first bytes before the rest is read.
+
+    Returns:
+        The audio content and its probe result.
+
+    Raises:
+        AudioRejected: If the audio cannot be downloaded, is too large or too long, or its format is not supported.
+    """
+    try:
+        with span("download"), http_session.get(url, timeout=stage_timeout("download"), stream=True) as r:
+            if r.status_code >= 400:
+                raise AudioRejected(422, "Failed to download the audio!")
+            content_length = r.headers.get("Content-Length")
+            check_content_headers(r.headers.get("Content-Type"), content_length)
+            expected_size = int(content_length) if content_length and content_length.isdigit() else None
+            chunks = []
+            size = 0
+            probe = None
+            for chunk in r.iter_content(chunk_size=probe_bytes):
+                check_deadline("download", "audio download timed out")
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > max_audio_bytes:
+                    raise AudioRejected(413, f"Audio is larger than {max_audio_bytes // (1024 * 1024)} MB!")
+                if probe is None and size >= probe_bytes:
+                    probe = check_audio(b"".join(chunks), expected_size or size)
+    except requests.exceptions.Timeout as e:
+        raise DeadlineExceeded("download", "audio download timed out") from e
+    audio_content = b"".join(chunks)
+    if probe is None or expected_size is None:
+        # Without a Content-Length the duration is only known once the whole audio is read
+        probe = check_audio(audio_content, size)
+    return audio_content, probe
+
+
+def decode_audio(func, audio, probe):
+    """
+    Normalizes an audio input, rejecting it as invalid when it cannot be decoded, e.g. an unrecognized format
+    which ffmpeg does not support either.
+    """
+    from pydub.exceptions import CouldntDecodeError
+
+    try:
+        return run_transform(func, audio, probe)
+    except CouldntDecodeError:
+        raise AudioRejected(422, "Invalid audio input!")
+
+
 def get_encoded_string(audio):
     if is_url(audio):
-        local_filename = generate_temp_filename("mp3")
-        with requests.get(audio) as r:
-            with open(local_filename, 'wb') as f:
-                f.write(r.content)
+        audio_content, probe = download_audio(audio)
+        return decode_audio(normalize_audio, audio_content, probe)
     elif is_base64(audio):
-        local_filename = generate_temp_filename("mp3")
-        decoded_audio_content = base64.b64decode(audio)
-        output_mp3_file = open(local_filename, "wb")
-        output_mp3_file.write(decoded_audio_content)
-        output_mp3_file.close()
+        probe = check_encoded_audio(audio)
+        return decode_audio(normalize_encoded_audio, audio, probe)
     else:
-        local_filename = audio
-
-    output_file = AudioSegment.from_file(local_filename)
-    mp3_output_file = output_file.export(local_filename, format="mp3")
-    given_audio = AudioSegment.from_file(mp3_output_file)
-    given_audio = given_audio.set_frame_rate(16000)
-    given_audio = given_audio.set_channels(1)
-    tmp_wav_filename = generate_temp_filename("wav")
-    given_audio.export(tmp_wav_filename, format="wav", codec="pcm_s16le")
-    with open(tmp_wav_filename, "rb") as wav_file:
-        wav_file_content = wav_file.read()
-    encoded_string = base64.b64encode(wav_file_content)
-    encoded_string = str(encoded_string, 'ascii', 'ignore')
-    os.remove(local_filename)
-    os.remove(tmp_wav_filename)
-    return encoded_string, wav_file_content
+        with open(audio, "rb") as audio_file:
+            audio_content = audio_file.read()
+        os.remove(audio)
+        probe = check_audio(audio_content, len(audio_content))
+        return decode_audio(normalize_audio, audio_content, probe)
 
 def speech_to_text(encoded_string, input_language):
     start_time = time.time()
@@ -131,12 +179,18 @@ def speech_to_text(encoded_string, input_language):
         'Content-Type': 'application/json'
     }
     try:
-        response = requests.request("POST", url, headers=headers, data=json.dumps(payload))
+        with span("asr"):
+            response = http_session.request("POST", url, headers=headers, data=json.dumps(payload),
+                                            timeout=stage_timeout("asr"))
         process_time = time.time() - start_time
         response.raise_for_status()
         log_success_telemetry_event(url, "POST", payload, process_time, status_code=response.status_code)
         text = json.loads(response.text)["pipelineResponse"][0]["output"][0]["source"]
         return text
+    except requests.exceptions.Timeout as e:
+        process_time = time.time() - start_time
+        log_failed_telemetry_event(url, "POST", payload, process_time, status_code=504, error=str(e))
+        raise DeadlineExceeded("asr", "speech to text timed out") from e
     except requests.exceptions.RequestException as e:
         process_time = time.time() - start_time
         log_failed_telemetry_event(url, "POST", payload, process_time, status_code=e.response.status_code, error=e.response.text)
@@ -175,11 +229,17 @@ def indic_translation(text, source, destination):
             'Content-Type': 'application/json'
         }
 
-        response = requests.request("POST", url, headers=headers, data=json.dumps(payload))
+        with span("translation"):
+            response = http_session.request("POST", url, headers=headers, data=json.dumps(payload),
+                                            timeout=stage_timeout("translation"))
         process_time = time.time() - start_time
         response.raise_for_status()
         log_success_telemetry_event(url, "POST", payload, process_time, status_code=response.status_code)
         indic_text = json.loads(response.text)["pipelineResponse"][0]["output"][0]["target"]
+    except requests.exceptions.Timeout as e:
+        process_time = time.time() - start_time
+        log_failed_telemetry_event(url, "POST", payload, process_time, status_code=504, error=str(e))
+        raise DeadlineExceeded("translation", "translation timed out") from e
     except requests.exceptions.RequestException as e:
         process_time = time.time() - start_time
         log_failed_telemetry_event(url, "POST", payload, process_time, status_code=e.response.status_code,
@@ -225,12 +285,18 @@ def text_to_speech(language, text, gender='female'):
             'Content-Type': 'application/json'
         }
 
-        response = requests.request("POST", url, headers=headers, data=json.dumps(payload))
+        with span("tts"):
+            response = http_session.request("POST", url, headers=headers, data=json.dumps(payload),
+                                            timeout=stage_timeout("tts"))
         process_time = time.time() - start_time
         response.raise_for_status()
         log_success_telemetry_event(url, "POST", payload, process_time, status_code=response.status_code)
         audio_content = response.json()["pipelineResponse"][0]['audio'][0]['audioContent']
         audio_content = base64.b64decode(audio_content)
+    except requests.exceptions.Timeout as e:
+        process_time = time.time() - start_time
+        log_failed_telemetry_event(url, "POST", payload, process_time, status_code=504, error=str(e))
+        raise DeadlineExceeded("tts", "text to speech timed out") from e
     except requests.exceptions.RequestException as e:
         process_time = time.time() - start_time
         log_failed_telemetry_event(url, "POST", payload, process_time, status_code=e.response.status_code,
@@ -239,12 +305,129 @@ def text_to_speech(language, text, gender='female'):
     return audio_content
 
 
+def build_pipeline_payload(tasks, source_language, target_language=None, text=None, encoded_audio=None,
+                           gender='female'):
+    """
+    Builds a Bhashini pipeline request which runs several tasks in a single call, each task taking the output of
+    the previous one as its input.
+
+    Args:
+        tasks: Task types in pipeline order, e.g. ["asr", "translation", "tts"].
+        source_language: Language of the input.
+        target_language: Language of the translation task's output.
+        text: Input text or list of texts, when the pipeline starts with translation or tts.
+        encoded_audio: Base64 encoded input audio, when the pipeline starts with asr.
+        gender: Voice of the tts task.
+
+    Returns:
+        The pipeline request payload.
+    """
+    pipeline_tasks = []
+    language = source_language
+    for task in tasks:
+        if task == "asr":
+            config = {"language": {"sourceLanguage": language}, "serviceId": asr_mapping[language]}
+        elif task == "translation":
+            config = {"language": {"sourceLanguage": language, "targetLanguage": target_language},
+                      "serviceId": translation_serviceId}
+            language = target_language
+        elif task == "tts":
+            config = {"language": {"sourceLanguage": language}, "serviceId": tts_mapping[language], "gender": gender}
+        else:
+            raise ValueError(f"Unsupported pipeline task: {task}")
+        pipeline_tasks.append({"taskType": task, "config": config})
+
+    if encoded_audio is not None:
+        input_data = {"audio": [{"audioContent": encoded_audio}]}
+    elif isinstance(text, list):
+        input_data = {"input": [{"source": item} for item in text]}
+    else:
+        input_data = {"input": [{"source": text}]}
+    return {"pipelineTasks": pipeline_tasks, "inputData": input_data}
+
+
+def post_pipeline(payload, stage="pipeline"):
+    """
+    Sends a pipeline request to Bhashini.
+
+    Returns:
+        The "pipelineResponse" list of the response, one entry per pipeline task.
+    """
+    start_time = time.time()
+    url = os.environ["BHASHINI_ENDPOINT_URL"]
+    headers = {
+        'Authorization': os.environ["BHASHINI_API_KEY"],
+        'Content-Type': 'application/json'
+    }
+    try:
+        with span(stage):
+            response = http_session.request("POST", url, headers=headers, data=json.dumps(payload),
+                                            timeout=stage_timeout(stage))
+        process_time = time.time() - start_time
+        response.raise_for_status()
+        log_success_telemetry_event(url, "POST", payload, process_time, status_code=response.status_code)
+    except requests.exceptions.Timeout as e:
+        process_time = time.time() - start_time
+        log_failed_telemetry_event(url, "POST", payload, process_time, status_code=504, error=str(e))
+        raise DeadlineExceeded(stage, "pipeline call timed out") from e
+    except requests.exceptions.RequestException as e:
+        process_time = time.time() - start_time
+        # Connection errors have no response
+        if e.response is not None:
+            log_failed_telemetry_event(url, "POST", payload, process_time, status_code=e.response.status_code,
+                                       error=e.response.text)
+        else:
+            log_failed_telemetry_event(url, "POST", payload, process_time, status_code=None, error=str(e))
+        raise RequestError(e.response) from e
+    return response.json()["pipelineResponse"]
+
+
+def run_pipeline(tasks, source_language, target_language=None, text=None, encoded_audio=None):
+    """
+    Runs several Bhashini tasks in one fused pipeline call.
+
+    Returns:
+        A dict with the output of every task: the transcript for "asr", the translated text for "translation"
+        and the decoded audio for "tts".
+    """
+    payload = build_pipeline_payload(tasks, source_language, target_language, text, encoded_audio)
+    outputs = {}
+    for task, task_response in zip(tasks, post_pipeline(payload)):
+        if task == "asr":
+            outputs[task] = task_response["output"][0]["source"]
+        elif task == "translation":
+            outputs[task] = task_response["output"][0]["target"]
+        elif task == "tts":
+            outputs[task] = base64.b64decode(task_response["audio"][0]["audioContent"])
+    return outputs
+
+
+def indic_translation_batch(texts, source, destination):
+    """
+    Translates several texts of the same language pair in one Bhashini call.
+
+    Returns:
+        The translated texts, in the order of the input texts.
+    """
+    if source == destination:
+        return list(texts)
+    payload = build_pipeline_payload(["translation"], source, destination, text=list(texts))
+    output = post_pipeline(payload, stage="translation")[0]["output"]
+    return [item["target"] for item in output]
+
+
 def audio_input_to_text(audio_file, input_language):
     encoded_string, wav_file_content = get_encoded_string(audio_file)
+    indic_text, _ = get_cached_transcript(wav_file_content, input_language, asr_mapping[input_language])
+    if indic_text is not None:
+        return indic_text
     try:
         indic_text = speech_to_text(encoded_string, input_language)
+    except DeadlineExceeded:
+        raise
     except:
         indic_text = None
+    cache_transcript(wav_file_content, input_language, asr_mapping[input_language], indic_text)
     return indic_text
 
 
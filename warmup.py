@@ -0,0 +1,59 @@
+import os
+import threading
+import time
+
+import requests
+
+from audio_pool import warm_up_pool
+from cloud_storage_oci import bucket_name, get_s3_client
+from config_util import get_config_value
+from few_shot_util import get_client, get_prompt
+from logger import logger
+from translator import http_session
+
+warmup_enabled = get_config_value('warmup', 'warmup_enabled', None).lower() == "true"
+warmup_connection_timeout = float(get_config_value('warmup', 'connection_timeout', None))
+
+_ready = threading.Event()
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def warm_up():
+    """
+    Starts the audio transform workers, initializes the clients, renders the few-shot prompt and pre-opens the
+    pooled connections to Bhashini, OCI object storage and Azure OpenAI, so that the first requests of a worker do
+    not pay for it.
+    Connection failures are logged and do not keep the worker from becoming ready. With the warm-up disabled, the
+    worker is ready at once and its first requests initialize what they use.
+    """
+    if not warmup_enabled:
+        _ready.set()
+        return
+    start_time = time.time()
+    try:
+        warm_up_pool()
+        get_prompt()
+    except Exception as e:
+        logger.error(f"Warm-up failed, worker is not ready: {e}", exc_info=True)
+        return
+
+    try:
+        http_session.head(os.environ["BHASHINI_ENDPOINT_URL"], timeout=warmup_connection_timeout)
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Warm-up of Bhashini connection failed: {e}")
+
+    try:
+        get_s3_client().head_bucket(Bucket=bucket_name)
+    except Exception as e:
+        logger.warning(f"Warm-up of OCI object storage connection failed: {e}")
+
+    try:
+        get_client().with_options(timeout=warmup_connection_timeout, max_retries=0).models.list()
+    except Exception as e:
+        logger.warning(f"Warm-up of Azure OpenAI connection failed: {e}")
+
+    _ready.set()
+    logger.info(f"Warm-up completed in {round(time.time() - start_time, 3)} seconds")